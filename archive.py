@@ -0,0 +1,48 @@
+import phidl.geometry as pg
+import gzip
+import json
+import mmap
+import os
+from params import to_jsonable, from_jsonable
+
+# Compact files of a built diode_array and fast reloading of them. The layout is
+# written as GDS, gzip-compressed on request, next to a small <filename>_layout.json
+# with the params, the build options and the name of the GDS file. Port tables are
+# not stored, they follow from the params in closed form (see preflight.py). The
+# bars, vias and pads are already arrayed cells (one AREF each) and hierarchical
+# builds share a cell per distinct route, so reloading reads every distinct shape
+# once and never redraws anything. Uncompressed files are read through a memory map.
+
+def gds_path(directory, filename, compress = False):
+    return os.path.join(directory, filename + (".gds.gz" if compress else ".gds"))
+
+def layout_path(directory, filename):
+    return os.path.join(directory, filename + "_layout.json")
+
+def write_gds(device, path, cellname, compress = False, compresslevel = 6):
+    if not compress:
+        device.write_gds(path, cellname = cellname)
+        return path
+    with gzip.open(path, "wb", compresslevel = compresslevel) as f:
+        device.write_gds(f, cellname = cellname)
+    return path
+
+def read_gds(path):
+    # returns the top cell as a Device with its hierarchy (and arrays) intact
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            return pg.import_gds(f)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as m:
+        return pg.import_gds(m)
+
+def save_layout(path, gds, params, options):
+    # gds is stored relative to the sidecar, so the pair can be moved together
+    with open(path, "w") as f:
+        json.dump({"gds": os.path.basename(gds), "params": to_jsonable(params), "options": to_jsonable(options)}, f)
+    return path
+
+def load_layout(path):
+    # (GDS path, params, options) as they were when the array was saved
+    with open(path) as f:
+        layout = json.load(f)
+    return os.path.join(os.path.dirname(path), layout["gds"]), from_jsonable(layout["params"]), layout["options"]
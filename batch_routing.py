@@ -0,0 +1,121 @@
+from phidl import Device
+from phidl.device_layout import Port
+import phidl.routing as pr
+import numpy as np
+from hierarchy import hierarchical_device
+
+# Vectorized counterparts of phidl.routing.route_sharp. Every route of a batch is
+# described by rows of (N, 2) midpoints and (N,) orientations/widths, and the
+# waypoint + extrusion math is the same as phidl's, evaluated for all rows at once.
+
+def _basis(orientations):
+    theta = np.radians(orientations)
+    return np.stack([np.cos(theta), np.sin(theta)], axis=-1)
+
+def _as_rows(values, n):
+    return np.broadcast_to(np.asarray(values, dtype=np.float64), (n,)).copy()
+
+def path_z(p1, o1, p2, o2, length1, length2):
+    pt2 = p1 + length1[:, None] * _basis(o1)
+    pt3 = p2 + length2[:, None] * _basis(o2)
+    return np.stack([p1, pt2, pt3, p2], axis=1)
+
+def path_manhattan(p1, o1, w1, p2, o2, w2):
+    # returns a list of (index, waypoints) groups, one per waypoint count
+    radius = np.maximum(w1, w2) + 0.1
+    e1 = _basis(o1)
+    e1_normal = np.stack([-e1[:, 1], e1[:, 0]], axis=-1)
+    displacement = p2 - p1
+    xrel = np.round(np.sum(displacement * e1, axis=1), 3)
+    yrel = np.round(np.sum(displacement * e1_normal, axis=1), 3)
+    orel = np.round(np.abs(np.mod(o2 - o1, 360)), 3)
+
+    orthogonal = (orel == 90) | (orel == 270)
+    l_shape = orthogonal & (((orel == 90) & (yrel < -radius)) | ((orel == 270) & (yrel > radius))) & (xrel > radius)
+    j_shape = orthogonal & ~l_shape
+    straight = (orel == 180) & (yrel == 0) & (xrel > 0)
+    other = ~(orthogonal | straight)
+
+    groups = []
+    if straight.any():
+        groups.append((np.flatnonzero(straight), np.stack([p1[straight], p2[straight]], axis=1)))
+    if l_shape.any():
+        pt2 = p1[l_shape] + np.sum((p2[l_shape] - p1[l_shape]) * e1[l_shape], axis=1)[:, None] * e1[l_shape]
+        groups.append((np.flatnonzero(l_shape), np.stack([p1[l_shape], pt2, p2[l_shape]], axis=1)))
+    if j_shape.any():
+        r, x, y = radius[j_shape], xrel[j_shape], yrel[j_shape]
+        direction = np.where(orel[j_shape] == 270, -1, 1)
+        length2 = np.where(np.abs(r + direction * y) < 2 * r, 2 * r - direction * y, r)
+        length1 = np.where(np.abs(r - x) < 2 * r, 2 * r + x, r)
+        e2 = _basis(o2[j_shape])
+        pt2 = p1[j_shape] + length1[:, None] * e1[j_shape]
+        pt4 = p2[j_shape] + length2[:, None] * e2
+        pt3 = pt2 + np.sum((pt4 - pt2) * e2, axis=1)[:, None] * e2
+        groups.append((np.flatnonzero(j_shape), np.stack([p1[j_shape], pt2, pt3, pt4, p2[j_shape]], axis=1)))
+    # C and U shapes never come up between facing pads and bars, hand them to phidl
+    for i in np.flatnonzero(other):
+        port1 = Port(midpoint=p1[i], width=w1[i], orientation=o1[i])
+        port2 = Port(midpoint=p2[i], width=w2[i], orientation=o2[i])
+        points = pr.path_manhattan(port1, port2, radius=max(w1[i], w2[i])).points
+        groups.append((np.array([i]), points[None]))
+    return groups
+
+def _offset_curve(points, offset_distance, start_angle, end_angle):
+    # phidl Path._centerpoint_offset_curve for a (N, K, 2) stack of paths
+    theta = np.arctan2(np.diff(points[:, :, 1], axis=1), np.diff(points[:, :, 0], axis=1))
+    theta = np.concatenate([theta[:, :1], theta, theta[:, -1:]], axis=1)
+    theta_mid = (np.pi + theta[:, 1:] + theta[:, :-1]) / 2
+    dtheta_int = np.pi + theta[:, :-1] - theta[:, 1:]
+    offset_distance = offset_distance / np.sin(dtheta_int / 2)
+    new_points = points.copy()
+    new_points[:, :, 0] -= offset_distance * np.cos(theta_mid)
+    new_points[:, :, 1] -= offset_distance * np.sin(theta_mid)
+    new_points[:, 0, 0] = points[:, 0, 0] + np.sin(start_angle * np.pi / 180) * offset_distance[:, 0]
+    new_points[:, 0, 1] = points[:, 0, 1] - np.cos(start_angle * np.pi / 180) * offset_distance[:, 0]
+    new_points[:, -1, 0] = points[:, -1, 0] + np.sin(end_angle * np.pi / 180) * offset_distance[:, -1]
+    new_points[:, -1, 1] = points[:, -1, 1] - np.cos(end_angle * np.pi / 180) * offset_distance[:, -1]
+    return new_points
+
+def extrude(points, w1, w2):
+    # extrudes (N, K, 2) waypoints with a width tapering linearly from w1 to w2,
+    # like route_sharp(width=None), and returns (N, 2K, 2) polygons
+    segment = np.diff(points, axis=1)
+    start_angle = np.round(np.arctan2(segment[:, 0, 1], segment[:, 0, 0]) / np.pi * 180, 6)
+    end_angle = np.round(np.arctan2(segment[:, -1, 1], segment[:, -1, 0]) / np.pi * 180, 6)
+    lengths = np.cumsum(np.sqrt(segment[:, :, 0] ** 2 + segment[:, :, 1] ** 2), axis=1)
+    lengths = np.concatenate([np.zeros((len(points), 1)), lengths], axis=1)
+    widths = w1[:, None] + lengths / lengths[:, -1:] * (w2 - w1)[:, None]
+    points1 = _offset_curve(points, widths / 2, start_angle, end_angle)
+    points2 = _offset_curve(points, -widths / 2, start_angle, end_angle)
+    return np.concatenate([points1, points2[:, ::-1]], axis=1)
+
+def route_polygons(p1, o1, w1, p2, o2, w2, path_type="Z", length1=None, length2=None, paths=None):
+    # given a list as paths, the (rows, (N, K, 2) waypoints) groups the polygons were extruded from are appended to it
+    p1 = np.asarray(p1, dtype=np.float64).reshape(-1, 2)
+    p2 = np.asarray(p2, dtype=np.float64).reshape(-1, 2)
+    n = len(p1)
+    if n == 0:
+        return []
+    o1, o2 = np.mod(_as_rows(o1, n), 360), np.mod(_as_rows(o2, n), 360)
+    w1, w2 = _as_rows(w1, n), _as_rows(w2, n)
+    if path_type == "Z":
+        groups = [(np.arange(n), path_z(p1, o1, p2, o2, _as_rows(length1, n), _as_rows(length2, n)))]
+    elif path_type == "manhattan":
+        groups = path_manhattan(p1, o1, w1, p2, o2, w2)
+    else:
+        raise ValueError("Invalid path type")
+    if paths is not None:
+        paths.extend(groups)
+    polygons = [None] * n
+    for index, points in groups:
+        for i, polygon in zip(index, extrude(points, w1[index], w2[index])):
+            polygons[i] = polygon
+    return polygons
+
+def route_device(polygons, layer, hierarchical = False):
+    if hierarchical:
+        return hierarchical_device(polygons, layer)
+    D = Device("routes")
+    if len(polygons) > 0:
+        D.add_polygon(polygons, layer=layer)
+    return D
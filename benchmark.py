@@ -0,0 +1,153 @@
+from multiprocessing import get_context
+from itertools import product
+import numpy as np
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+# Reproducible timing of diode_array builds. Every case runs in a fresh worker
+# process (so the text/glyph caches and stage memo start cold) and records the
+# time of each build stage (from diode_array.profile), the GDS write time, the
+# tracemalloc peak and the size of the written GDS. The peak comes from a second,
+# traced run so that tracemalloc does not distort the timings.
+
+PAD_STYLES = ["double", "single", "interleaved", "single_line"]
+SIZES = [16, 32, 64, 128, 256, 512, 1024]
+
+def base_params(pad_style, n, invert_be):
+    params = {
+        "pad_dimensions": np.array([60, 60, 5]),
+        "pad_pitch": 100,
+        "bar_width": 20,
+        "bar_pitch": 40,
+        "num_bars": np.array([n, n]),
+        "circle_radius": 5,
+        "bar_pad_spacing": np.array([120, 120]),
+        "interleaved_pad_spacing": 15,
+        "pad_route_dist": 20,
+        "pad_style": pad_style,
+        "route_thetas": [np.pi/4, np.pi/4],
+        "text_size": 40,
+        "invert_be": invert_be
+    }
+    # leave room for the pads to fan out at 45 degrees, as the size grows
+    params["bar_pad_spacing"] = params["bar_pad_spacing"] + (n - 1) * (params["pad_pitch"] - params["bar_pitch"]) / 2
+    return params
+
+def run_case(params, build_kwargs, traced):
+    from diode_array import diode_array
+    array = diode_array(params)
+
+    if traced:
+        tracemalloc.start()
+    with array.profile() as profiler:
+        array.build(**build_kwargs)
+    build_time = profiler.total_time
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        array.save(directory=directory, filename="benchmark")
+        save_time = time.perf_counter() - start
+        gds_size = os.path.getsize(os.path.join(directory, "benchmark.gds"))
+    peak = tracemalloc.get_traced_memory()[1] if traced else None
+    if traced:
+        tracemalloc.stop()
+
+    stages = {r["stage"]: r["time"] for r in profiler.records}
+    stages["assembly"] = build_time - sum(stages.values())
+    stages["write_gds"] = save_time
+    counts = {r["stage"]: {k: r[k] for k in ["cells", "polygons", "references", "ports"]} for r in profiler.records}
+    return {"stages": stages, "counts": counts, "build_time": build_time, "total_time": build_time + save_time,
+            "peak_memory": peak, "gds_size": gds_size, "polygons": len(array.device.get_polygons())}
+
+def run_isolated(params, build_kwargs, traced):
+    with get_context("spawn").Pool(1, maxtasksperchild = 1) as pool:
+        return pool.apply(run_case, (params, build_kwargs, traced))
+
+def benchmark(pad_styles = PAD_STYLES, sizes = SIZES, invert = [False, True], repeat = 1, memory = True, build_kwargs = None):
+    results = []
+    for pad_style, n, invert_be in product(pad_styles, sizes, invert):
+        params = base_params(pad_style, n, invert_be)
+        runs = [run_isolated(params, build_kwargs or {}, False) for _ in range(repeat)]
+        # the fastest repeat is the least disturbed by the rest of the machine
+        result = min(runs, key = lambda r: r["total_time"])
+        if memory:
+            result["peak_memory"] = run_isolated(params, build_kwargs or {}, True)["peak_memory"]
+        result.update({"pad_style": pad_style, "num_bars": n, "invert_be": invert_be})
+        results.append(result)
+        print(f"{pad_style:>12} {n:>5} invert_be={invert_be!s:<5} {result['total_time']:8.2f} s", flush = True)
+    return results
+
+def metadata(build_kwargs):
+    import phidl
+    from build_cache import library_version
+    return {"library_version": library_version(), "phidl": phidl.__version__, "numpy": np.__version__,
+            "python": platform.python_version(), "machine": platform.machine(), "processor": platform.processor(),
+            "cpus": os.cpu_count(), "build_kwargs": build_kwargs, "date": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+def case_key(result):
+    return (result["pad_style"], result["num_bars"], result["invert_be"])
+
+def compare(baseline, current, threshold = 0.1, min_time = 0.05):
+    # returns one row per metric that got worse by more than threshold (relative);
+    # times below min_time seconds are too noisy to compare
+    regressions = []
+    baseline = {case_key(r): r for r in baseline["results"]}
+    for result in current["results"]:
+        old = baseline.get(case_key(result))
+        if old is None:
+            continue
+        metrics = [("total_time", old["total_time"], result["total_time"])]
+        metrics += [("stage " + name, old["stages"].get(name), t) for name, t in result["stages"].items()]
+        metrics += [("peak_memory", old["peak_memory"], result["peak_memory"]), ("gds_size", old["gds_size"], result["gds_size"])]
+        for metric, before, after in metrics:
+            if before is None or after is None:
+                continue
+            if (metric == "total_time" or metric.startswith("stage")) and max(before, after) < min_time:
+                continue
+            if after > before * (1 + threshold):
+                regressions.append({"pad_style": result["pad_style"], "num_bars": result["num_bars"], "invert_be": result["invert_be"],
+                                    "metric": metric, "baseline": before, "current": after, "change": after / max(before, 1e-12) - 1})
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Benchmark diode_array build time, peak memory and GDS size.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the benchmark and write the results as JSON")
+    run.add_argument("-o", "--output", default="benchmark.json")
+    run.add_argument("-s", "--sizes", type=int, nargs="+", default=SIZES)
+    run.add_argument("-p", "--pad-styles", nargs="+", default=PAD_STYLES, choices=PAD_STYLES)
+    run.add_argument("--invert", choices=["both", "on", "off"], default="both")
+    run.add_argument("-r", "--repeat", type=int, default=1)
+    run.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    run.add_argument("--build-kwargs", default="{}", help="JSON dict passed to diode_array.build")
+    check = commands.add_parser("compare", help="compare two benchmark JSON files")
+    check.add_argument("baseline")
+    check.add_argument("current")
+    check.add_argument("-t", "--threshold", type=float, default=0.1, help="relative slowdown/growth that counts as a regression")
+    check.add_argument("--min-time", type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        build_kwargs = json.loads(args.build_kwargs)
+        invert = {"both": [False, True], "on": [True], "off": [False]}[args.invert]
+        results = benchmark(args.pad_styles, args.sizes, invert, args.repeat, not args.no_memory, build_kwargs)
+        with open(args.output, "w") as f:
+            json.dump({"metadata": metadata(build_kwargs), "results": results}, f, indent=1)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold, args.min_time)
+    for r in regressions:
+        print(f"{r['pad_style']:>12} {r['num_bars']:>5} invert_be={r['invert_be']!s:<5} {r['metric']:<16} {r['baseline']:.4g} -> {r['current']:.4g} (+{100 * r['change']:.0f}%)")
+    print(f"{len(regressions)} regressions" if regressions else "no regressions")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
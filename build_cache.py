@@ -0,0 +1,181 @@
+import phidl
+from archive import read_gds, write_gds, save_layout, layout_path
+from params import normalize
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import time
+
+# On-disk cache of built arrays keyed by a hash of the normalized params, the build
+# options and the library version. Entries are the GDS written by diode_array.save
+# plus a small JSON sidecar; the least recently used entries are evicted once the
+# cache grows past max_bytes. Several processes may share a directory: every file is
+# written under a temporary name and renamed into place, the GDS last, so an entry
+# is only visible once it is complete, and eviction leaves alone the entries written
+# while the evicting process was building.
+
+# modules whose source determines the generated geometry
+SOURCES = ["diode_array.py", "batch_routing.py", "inversion.py", "hierarchy.py", "ports.py", "archive.py", "params.py"]
+# files diode_array.save writes next to an entry's GDS, and the one the cache adds
+SIDECARS = ["_layout.json", ".json"]
+# build options that change how fast an array is built but not what is built
+IGNORED_BUILD_KWARGS = ["invert_workers"]
+
+def write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+def library_version():
+    digest = hashlib.sha256(f"phidl {phidl.__version__}".encode())
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in SOURCES:
+        with open(os.path.join(here, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def build_options(build_kwargs = None):
+    # build_kwargs over the defaults of diode_array.build, so that leaving an option out and
+    # passing its default value describe the same build
+    from diode_array import diode_array
+    defaults = {k: p.default for k, p in inspect.signature(diode_array.set_options).parameters.items() if p.default is not p.empty}
+    return dict(defaults, **(build_kwargs or {}))
+
+def params_key(params, build_kwargs = None, version = None):
+    build_kwargs = {k: v for k, v in build_options(build_kwargs).items() if k not in IGNORED_BUILD_KWARGS}
+    payload = {"params": normalize(params), "build": normalize(build_kwargs), "version": version or library_version()}
+    # 32 hex digits keep the key usable as a GDS cell name
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:32]
+
+class build_cache:
+    def __init__(self, directory, max_bytes = 2 * 1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = library_version()
+        self.hits, self.misses, self.bytes_saved = 0, 0, 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".gds")
+
+    def key(self, params, build_kwargs = None):
+        return params_key(params, build_kwargs, self.version)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def replace(self, path, write):
+        # write(temporary path) then rename it to path; temporary files are hidden and keep the
+        # extension of path, which phidl's write_gds would otherwise append
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix="." + os.path.basename(path) + ".", suffix=os.path.splitext(path)[1])
+        os.close(fd)
+        try:
+            write(tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def put(self, key, array, params = None, build_kwargs = None, started = None):
+        # the files diode_array.save writes, under the cache's names; started is when the build
+        # began, entries written since then are not evicted
+        path = self.path(key)
+        entry = {"params": normalize(params or {}), "build": normalize(build_kwargs or {}), "version": self.version}
+        self.replace(layout_path(self.directory, key), lambda tmp: save_layout(tmp, path, array.params, array.options))
+        self.replace(os.path.join(self.directory, key + ".json"), lambda tmp: write_json(tmp, entry))
+        self.replace(path, lambda tmp: write_gds(array.device, tmp, key))
+        self.evict(keep=key, newer_than=started)
+        return path
+
+    def build(self, params, **build_kwargs):
+        # returns the path of a GDS for params, drawing it only on a cache miss
+        from diode_array import diode_array
+        key = self.key(params, build_kwargs)
+        path = self.get(key)
+        if path is not None:
+            self.hits += 1
+            self.bytes_saved += os.path.getsize(path)
+            return path
+        self.misses += 1
+        started = time.time()
+        array = diode_array(params)
+        array.build(**build_kwargs)
+        return self.put(key, array, params, build_kwargs, started)
+
+    def load(self, params, **build_kwargs):
+        return read_gds(self.build(params, **build_kwargs))
+
+    def copy(self, params, directory, filename, **build_kwargs):
+        destination = os.path.join(directory, filename + ".gds")
+        shutil.copyfile(self.build(params, **build_kwargs), destination)
+        return destination
+
+    def mtimes(self):
+        # {path: mtime} of every entry; entries another process removes meanwhile are left out
+        mtimes = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(".gds") and not name.startswith("."):
+                path = os.path.join(self.directory, name)
+                try:
+                    mtimes[path] = os.path.getmtime(path)
+                except FileNotFoundError:
+                    pass
+        return mtimes
+
+    def entries(self):
+        mtimes = self.mtimes()
+        return sorted(mtimes, key=mtimes.get)
+
+    def files(self, path):
+        # an entry's GDS and the sidecars next to it
+        return [path] + [f for f in [path[:-4] + s for s in SIDECARS] if os.path.exists(f)]
+
+    def entry_bytes(self, path):
+        size = 0
+        for f in self.files(path):
+            try:
+                size += os.path.getsize(f)
+            except FileNotFoundError:
+                pass
+        return size
+
+    def evict(self, keep = None, newer_than = None):
+        # least recently used first; entries used or written after newer_than (a time.time()) are
+        # kept, they may belong to a build running in another process
+        mtimes = self.mtimes()
+        entries = sorted(mtimes, key=mtimes.get)
+        total = sum(self.entry_bytes(p) for p in entries)
+        for path in entries:
+            if total <= self.max_bytes:
+                break
+            if keep is not None and path == self.path(keep):
+                continue
+            if newer_than is not None and mtimes[path] >= newer_than:
+                continue
+            total -= self.entry_bytes(path)
+            self.remove(path)
+
+    def remove(self, path):
+        # the GDS goes first, so the entry stops being a hit before its sidecars disappear
+        for f in self.files(path):
+            try:
+                os.remove(f)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for path in self.entries():
+            self.remove(path)
+
+    def stats(self):
+        entries = self.entries()
+        return {"hits": self.hits, "misses": self.misses, "bytes_saved": self.bytes_saved,
+                "entries": len(entries), "bytes": sum(self.entry_bytes(p) for p in entries), "max_bytes": self.max_bytes}
@@ -1,11 +1,71 @@
-from phidl import set_quickplot_options, Device, Group, quickplot as qp
+from phidl import Device, Group
 import phidl.geometry as pg
-import phidl.routing as pr
+from phidl.constants import _width, _indent
 import numpy as np
 import os
+from functools import lru_cache
+from contextlib import contextmanager
+from batch_routing import route_polygons, route_device
+from ports import port_table, points
+from netlist import netlist, route_record
+from inversion import invert_tiled, invert_tiles, add_fractured, geometry, bounding_box
+from streaming import gds_stream
+from archive import gds_path, layout_path, write_gds, read_gds, save_layout, load_layout
+from hierarchy import gds_size
+from params import normalize
+from instrumentation import stage_profiler
+import copy
+import hashlib
+import inspect
+import json
+import warnings
+
+@lru_cache(maxsize = 256)
+def glyph_cell(char, size, layer):
+    return pg.text(text=char, size=size, justify='left', layer=layer)
+
+@lru_cache(maxsize = 4096)
+def text_label(text, size, layer, rotation, glyphs = False):
+    if not glyphs:
+        return pg.text(text=text, size=size, justify='left', layer=layer).rotate(rotation)
+    # same character advance as pg.text, but each character is a reference to a shared glyph cell
+    label = Device("text")
+    xoffset = 0
+    for char in text:
+        label.add_ref(glyph_cell(char, size, layer)).move(destination=(xoffset, 0))
+        xoffset += (_width[ord(char)] + _indent[ord(char)]) * size / 1000
+    return label.rotate(rotation)
 
 class diode_array:
+    # params (and build options) each stage depends on, and the upstream stages whose output it takes
+    STAGES = {
+        "bars": (["bar_width", "bar_pitch", "num_bars"], []),
+        "circles": (["circle_radius", "bar_pitch", "num_bars"], []),
+        "pads": (["pad_style", "pad_dimensions", "pad_pitch", "bar_pad_spacing", "interleaved_pad_spacing", "single_pad_offsets"], ["bars"]),
+        "labels": (["text_size", "hierarchical"], ["pads"]),
+        "routes": (["pad_route_dist", "route_thetas", "hierarchical"], ["bars", "pads"]),
+        "inversion": (["invert_mode", "invert_tiles"], ["bars", "pads", "routes"]),
+    }
+
+    # the keys of a params dict, as read by set_params
+    PARAMS = ["pad_dimensions", "pad_pitch", "bar_width", "bar_pitch", "num_bars", "circle_radius", "bar_pad_spacing",
+              "pad_route_dist", "route_thetas", "pad_style", "interleaved_pad_spacing", "text_size", "invert_be"]
+
     def __init__(self, params):
+        self.params = dict(params)
+        self.set_params(self.params)
+        self.device = Device()
+        self.be = Device()
+        self.hierarchical = False
+        self.options = {}
+        self.stages = {}
+        self.rebuilt = []
+        self.profiler = None
+        self.profile_report = None
+        self.route_records = []
+        self.loaded_ports = None
+
+    def set_params(self, params):
         self.pad_dimensions = params["pad_dimensions"]
         self.pad_pitch = params["pad_pitch"]
         self.bar_width = params["bar_width"]
@@ -21,8 +81,6 @@ class diode_array:
         self.interleaved_pad_spacing = params["interleaved_pad_spacing"]
         self.text_size = params["text_size"]
         self.invert_be = params["invert_be"]
-        self.device = Device()
-        self.be = Device()
     
     def draw_bars(self, device, be):
         vb = pg.rectangle(size = (self.bar_width, self.bar_lengths[1]), layer = 1)
@@ -33,22 +91,24 @@ class diode_array:
         hb_array = device.add_array(hb, columns = 1, rows = self.num_bars[1], spacing = (0, self.bar_pitch))
         hb_array.move(origin=hb_array.center, destination=(0, 0))
 
-        vb_top_ports, vb_bottom_ports, hb_left_ports, hb_right_ports = [], [], [], []
+        (vb_xmin, vb_ymin), (_, vb_ymax) = vb_array.bbox
+        (hb_xmin, hb_ymin), (hb_xmax, _) = hb_array.bbox
 
-        for i in range(self.num_bars[0]):
-            vb_bottom_ports.append(be.add_port(midpoint = (vb_array.xmin + self.bar_width/2 + i * self.bar_pitch, vb_array.ymin), width = self.bar_width, orientation = -90, name=f"b{i}")) # bottom
-            vb_top_ports.append(be.add_port(midpoint = (vb_array.xmin + self.bar_width/2 + i * self.bar_pitch, vb_array.ymax), width = self.bar_width, orientation = 90, name=f"t{i}")) # top
+        i = np.arange(self.num_bars[0])
+        vb_bottom_ports = port_table(points(vb_xmin + self.bar_width/2 + i * self.bar_pitch, vb_ymin), self.bar_width, -90, "b", i) # bottom
+        vb_top_ports = port_table(points(vb_xmin + self.bar_width/2 + i * self.bar_pitch, vb_ymax), self.bar_width, 90, "t", i) # top
 
-        for i in range(self.num_bars[1]):
-            hb_left_ports.append(device.add_port(midpoint = (hb_array.xmin, hb_array.ymin + self.bar_width/2 + i * self.bar_pitch), width = self.bar_width, orientation = 180, name=f"l{i}")) # left
-            hb_right_ports.append(device.add_port(midpoint = (hb_array.xmax, hb_array.ymin + self.bar_width/2 + i * self.bar_pitch), width = self.bar_width, orientation = 0, name=f"r{i}")) # right
+        i = np.arange(self.num_bars[1])
+        hb_left_ports = port_table(points(hb_xmin, hb_ymin + self.bar_width/2 + i * self.bar_pitch), self.bar_width, 180, "l", i) # left
+        hb_right_ports = port_table(points(hb_xmax, hb_ymin + self.bar_width/2 + i * self.bar_pitch), self.bar_width, 0, "r", i) # right
 
         return [vb_array, hb_array], [vb_bottom_ports, vb_top_ports, hb_left_ports, hb_right_ports]
     
     def draw_circles(self, device):
         circle = pg.circle(radius = self.circle_radius, layer = 2)
         circle_array = device.add_array(circle, columns = self.num_bars[0], rows = self.num_bars[1], spacing = (self.bar_pitch, self.bar_pitch))
-        circle_array.move(origin=circle_array.center, destination=(0, 0))
+        # circle_array.center would transform a bounding box per circle
+        circle_array.move(origin=bounding_box(device).mean(axis=0), destination=(0, 0))
         return circle_array
 
     def draw_pads_single(self, device, be, pad_offset):
@@ -82,39 +142,16 @@ class diode_array:
         h_pad_5_array_right = device.add_array(h_pad_5, columns = 1, rows = np.floor(self.num_bars[1]/2), spacing = (0, self.pad_pitch))
         h_pad_5_array_right.move(origin=h_pad_5_array_right.center, destination=(self.bar_lengths[0]/2 + self.bar_pad_spacing[1] + self.pad_dimensions[1]/2, pad_offset[3]))
 
-        top_ports, bottom_ports, left_ports, right_ports = [], [], [], []
-        for i in range(self.num_bars[0]):
-            if i % 2 == 0:
-                bottom_ports.append(be.add_port(midpoint = (v_pad_0_array_bottom.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i/2 * self.pad_pitch,v_pad_0_array_bottom.ymax), width = self.bar_width, orientation = 90, name=f"pb{i}"))
-            else:
-                top_ports.append(be.add_port(midpoint = (v_pad_0_array_top.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + (i-1)/2 * self.pad_pitch,v_pad_0_array_top.ymin), width = self.bar_width, orientation = -90, name=f"pt{i}"))
-        
-        for i in range(self.num_bars[1]):
-            if i % 2 == 0:
-                left_ports.append(device.add_port(midpoint = (h_pad_3_array_left.xmax,h_pad_3_array_left.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i/2 * self.pad_pitch), width = self.bar_width, orientation = 0, name=f"pl{i}"))
-            else:
-                right_ports.append(device.add_port(midpoint = (h_pad_3_array_right.xmin,h_pad_3_array_right.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + (i-1)/2 * self.pad_pitch), width = self.bar_width, orientation = 180, name=f"pr{i}"))
-
-        # text labels
-        for i in range(self.num_bars[0]):
-            if i % 2 == 0:
-                t1 = pg.text(text=str(i), size=self.text_size, justify='left', layer=4).rotate(90)
-                t1.move(origin=(t1.center[0], t1.ymax), destination=(v_pad_0_array_bottom.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i/2 * self.pad_pitch, v_pad_0_array_bottom.ymin - 20))
-                device.add_ref(t1)
-            else:
-                t2 = pg.text(text=str(i), size=self.text_size, justify='left', layer=4).rotate(90)
-                t2.move(origin=(t2.center[0], t2.ymin), destination=(v_pad_0_array_top.xmin + self.pad_dimensions[0]/2 + + self.pad_dimensions[2] + (i-1)/2 * self.pad_pitch, v_pad_0_array_top.ymax + 20))
-                device.add_ref(t2)
-        for i in range(self.num_bars[1]):
-            if i % 2 == 0:
-                t1 = pg.text(text=str(i), size=self.text_size, justify='left', layer=3)
-                t1.move(origin=(t1.xmax, t1.center[1]), destination=(h_pad_3_array_left.xmin - 20, h_pad_3_array_left.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i/2 * self.pad_pitch))
-                device.add_ref(t1)
-            else:
-                t2 = pg.text(text=str(i), size=self.text_size, justify='left', layer=3)
-                t2.move(origin=(t2.xmin, t2.center[1]), destination=(h_pad_3_array_right.xmax + 20, h_pad_3_array_right.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + (i-1)/2 * self.pad_pitch))
-                device.add_ref(t2)
+        # even bars go to the bottom/left pads, odd bars to the top/right pads
+        i = np.arange(0, self.num_bars[0], 2)
+        bottom_ports = port_table(points(v_pad_0_array_bottom.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i/2 * self.pad_pitch, v_pad_0_array_bottom.ymax), self.bar_width, 90, "pb", i)
+        i = np.arange(1, self.num_bars[0], 2)
+        top_ports = port_table(points(v_pad_0_array_top.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + (i-1)/2 * self.pad_pitch, v_pad_0_array_top.ymin), self.bar_width, -90, "pt", i)
 
+        i = np.arange(0, self.num_bars[1], 2)
+        left_ports = port_table(points(h_pad_3_array_left.xmax, h_pad_3_array_left.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i/2 * self.pad_pitch), self.bar_width, 0, "pl", i)
+        i = np.arange(1, self.num_bars[1], 2)
+        right_ports = port_table(points(h_pad_3_array_right.xmin, h_pad_3_array_right.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + (i-1)/2 * self.pad_pitch), self.bar_width, 180, "pr", i)
 
         return [v_pad_0_array_bottom, v_pad_0_array_top, v_pad_4_array_bottom, v_pad_4_array_top, h_pad_3_array_left, h_pad_3_array_right, h_pad_5_array_left, h_pad_5_array_right], [bottom_ports, top_ports, left_ports, right_ports]
     
@@ -148,31 +185,13 @@ class diode_array:
         h_pad_5_array_right = device.add_array(h_pad_5, columns = 1, rows = self.num_bars[1], spacing = (0, self.pad_pitch))
         h_pad_5_array_right.move(origin=h_pad_5_array_right.center, destination=(self.bar_lengths[0]/2 + self.bar_pad_spacing[1] + self.pad_dimensions[1]/2, 0))
 
-        top_ports, bottom_ports, left_ports, right_ports = [], [], [], []
-        for i in range(self.num_bars[0]):
-                bottom_ports.append(be.add_port(midpoint = (v_pad_1_array_bottom.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch,v_pad_1_array_bottom.ymax), width = self.bar_width, orientation = 90, name=f"pb{i}"))
-                top_ports.append(be.add_port(midpoint = (v_pad_1_array_top.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch,v_pad_1_array_top.ymin), width = self.bar_width, orientation = -90, name=f"pt{i}"))
-        
-        for i in range(self.num_bars[1]):
-                left_ports.append(device.add_port(midpoint = (h_pad_3_array_left.xmax,h_pad_3_array_left.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch), width = self.bar_width, orientation = 0, name=f"pl{i}"))
-                right_ports.append(device.add_port(midpoint = (h_pad_3_array_right.xmin,h_pad_3_array_right.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch), width = self.bar_width, orientation = 180, name=f"pr{i}"))
-
-        # text labels
-        for i in range(self.num_bars[0]):
-            t1 = pg.text(text=str(i), size=self.text_size, justify='left', layer=4).rotate(90)
-            t1.move(origin=(t1.center[0], t1.ymax), destination=(v_pad_1_array_bottom.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch, v_pad_1_array_bottom.ymin - 20))
-            t2 = pg.text(text=str(i), size=self.text_size, justify='left', layer=4).rotate(90)
-            t2.move(origin=(t2.center[0], t2.ymin), destination=(v_pad_1_array_top.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch, v_pad_1_array_top.ymax + 20))
-            device.add_ref(t1)
-            device.add_ref(t2)
-        for i in range(self.num_bars[1]):
-            t1 = pg.text(text=str(i), size=self.text_size, justify='left', layer=3)
-            t1.move(origin=(t1.xmax, t1.center[1]), destination=(h_pad_3_array_left.xmin - 20, h_pad_3_array_left.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch))
-            t2 = pg.text(text=str(i), size=self.text_size, justify='left', layer=3)
-            t2.move(origin=(t2.xmin, t2.center[1]), destination=(h_pad_3_array_right.xmax + 20, h_pad_3_array_left.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch))
-            device.add_ref(t1)
-            device.add_ref(t2)
+        i = np.arange(self.num_bars[0])
+        bottom_ports = port_table(points(v_pad_1_array_bottom.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch, v_pad_1_array_bottom.ymax), self.bar_width, 90, "pb", i)
+        top_ports = port_table(points(v_pad_1_array_top.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch, v_pad_1_array_top.ymin), self.bar_width, -90, "pt", i)
 
+        i = np.arange(self.num_bars[1])
+        left_ports = port_table(points(h_pad_3_array_left.xmax, h_pad_3_array_left.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch), self.bar_width, 0, "pl", i)
+        right_ports = port_table(points(h_pad_3_array_right.xmin, h_pad_3_array_right.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch), self.bar_width, 180, "pr", i)
 
         return [v_pad_1_array_bottom, v_pad_1_array_top, v_pad_4_array_bottom, v_pad_4_array_top, h_pad_3_array_left, h_pad_3_array_right, h_pad_5_array_left, h_pad_5_array_right], [bottom_ports, top_ports, left_ports, right_ports]
 
@@ -197,21 +216,8 @@ class diode_array:
         larger_pads.move(origin=larger_pads.center, destination=(self.bar_lengths[0]/2 + self.bar_pad_spacing[1] + self.pad_dimensions[1]/2, 0))
         smaller_pads.move(origin=smaller_pads.center, destination=(self.bar_lengths[0]/2 + self.bar_pad_spacing[1] + self.pad_dimensions[1]/2, 0))
 
-        right_ports = []
-
-        for i in range(self.num_bars[0] + self.num_bars[1]):
-                right_ports.append(device.add_port(midpoint = (h_pad_1_array_right.xmin,h_pad_1_array_right.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch), width = self.bar_width, orientation = 180, name=f"pr{i}"))
-
-        # text labels
-        for i in range(self.num_bars[0] + self.num_bars[1]):
-
-            if i < self.num_bars[0]:
-                t = pg.text(text="v" + str(i), size=self.text_size, justify='left', layer=3)
-            else:
-                t = pg.text(text="h" + str(i-self.num_bars[0]), size=self.text_size, justify='left', layer=3)
-            t.move(origin=(t.xmin, t.center[1]), destination=(h_pad_1_array_right.xmax + 20, h_pad_1_array_right.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch))
-            device.add_ref(t)
-
+        i = np.arange(self.num_bars[0] + self.num_bars[1])
+        right_ports = port_table(points(h_pad_1_array_right.xmin, h_pad_1_array_right.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch), self.bar_width, 180, "pr", i)
 
         return [h_pad_1_array_right, h_pad_4_array_right, h_pad_3_array_right, h_pad_5_array_right], right_ports
 
@@ -262,198 +268,480 @@ class diode_array:
         h_pad_5_array_right_2 = device.add_array(h_pad_5, columns = 1, rows = np.floor(self.num_bars[1]/2), spacing = (0, self.pad_pitch))
         h_pad_5_array_right_2.move(origin=h_pad_5_array_right_2.center, destination=(-h_pad_5_array_left_1.center[0], h_pad_5_array_left_2.center[1]))
 
-        top_ports, bottom_ports, left_ports, right_ports = [], [], [], []
+        # even bars go to the inner (_1) row of pads, odd bars to the outer (_2) row
+        i = np.arange(self.num_bars[0])
+        even = i % 2 == 0
+        x1 = self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i/2 * self.pad_pitch
+        x2 = self.pad_dimensions[0]/2 + self.pad_dimensions[2] + (i-1)/2 * self.pad_pitch
+        bottom_ports = port_table(points(np.where(even, v_pad_1_array_bottom_1.xmin + x1, v_pad_1_array_bottom_2.xmin + x2), np.where(even, v_pad_1_array_bottom_1.ymax, v_pad_1_array_bottom_2.ymax)), self.bar_width, 90, "pb", i)
+        top_ports = port_table(points(np.where(even, v_pad_1_array_top_1.xmin + x1, v_pad_1_array_top_2.xmin + x2), np.where(even, v_pad_1_array_top_1.ymin, v_pad_1_array_top_2.ymin)), self.bar_width, -90, "pt", i)
+
+        i = np.arange(self.num_bars[1])
+        even = i % 2 == 0
+        y1 = self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i/2 * self.pad_pitch
+        y2 = self.pad_dimensions[0]/2 + self.pad_dimensions[2] + (i-1)/2 * self.pad_pitch
+        left_ports = port_table(points(np.where(even, h_pad_2_array_left_1.xmax, h_pad_2_array_left_2.xmax), np.where(even, h_pad_2_array_left_1.ymin + y1, h_pad_2_array_left_2.ymin + y2)), self.bar_width, 0, "pl", i)
+        right_ports = port_table(points(np.where(even, h_pad_2_array_right_1.xmin, h_pad_2_array_right_2.xmin), np.where(even, h_pad_2_array_right_1.ymin + y1, h_pad_2_array_right_2.ymin + y2)), self.bar_width, 180, "pr", i)
+
+        return [v_pad_1_array_bottom_1, v_pad_1_array_bottom_2, v_pad_1_array_top_1, v_pad_1_array_top_2, v_pad_4_array_bottom_1, v_pad_4_array_bottom_2, v_pad_4_array_top_1, v_pad_4_array_top_2, h_pad_2_array_left_1, h_pad_2_array_left_2, h_pad_2_array_right_1, h_pad_2_array_right_2, h_pad_5_array_left_1, h_pad_5_array_left_2, h_pad_5_array_right_1, h_pad_5_array_right_2], [bottom_ports, top_ports, left_ports, right_ports]
+ 
+    def draw_labels_single(self, device, pads):
+        # pad array bounds are looked up once, each lookup transforms every pad in the array
+        (bottom_xmin, bottom_ymin), _ = pads[0].bbox
+        (top_xmin, _), (_, top_ymax) = pads[1].bbox
+        (left_xmin, left_ymin), _ = pads[4].bbox
+        (_, right_ymin), (right_xmax, _) = pads[5].bbox
         for i in range(self.num_bars[0]):
             if i % 2 == 0:
-                bottom_ports.append(be.add_port(midpoint = (v_pad_1_array_bottom_1.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i/2 * self.pad_pitch,v_pad_1_array_bottom_1.ymax), width = self.bar_width, orientation = 90, name=f"pb{i}"))
-                top_ports.append(be.add_port(midpoint = (v_pad_1_array_top_1.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i/2 * self.pad_pitch,v_pad_1_array_top_1.ymin), width = self.bar_width, orientation = -90, name=f"pt{i}"))
+                t1 = device.add_ref(text_label(str(i), self.text_size, 4, 90, self.hierarchical))
+                t1.move(origin=(t1.center[0], t1.ymax), destination=(bottom_xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i/2 * self.pad_pitch, bottom_ymin - 20))
             else:
-                bottom_ports.append(be.add_port(midpoint = (v_pad_1_array_bottom_2.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + (i-1)/2 * self.pad_pitch,v_pad_1_array_bottom_2.ymax), width = self.bar_width, orientation = 90, name=f"pb{i}"))
-                top_ports.append(be.add_port(midpoint = (v_pad_1_array_top_2.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + (i-1)/2 * self.pad_pitch,v_pad_1_array_top_2.ymin), width = self.bar_width, orientation = -90, name=f"pt{i}"))
-        
+                t2 = device.add_ref(text_label(str(i), self.text_size, 4, 90, self.hierarchical))
+                t2.move(origin=(t2.center[0], t2.ymin), destination=(top_xmin + self.pad_dimensions[0]/2 + + self.pad_dimensions[2] + (i-1)/2 * self.pad_pitch, top_ymax + 20))
         for i in range(self.num_bars[1]):
             if i % 2 == 0:
-                left_ports.append(device.add_port(midpoint = (h_pad_2_array_left_1.xmax,h_pad_2_array_left_1.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i/2 * self.pad_pitch), width = self.bar_width, orientation = 0, name=f"pl{i}"))
-                right_ports.append(device.add_port(midpoint = (h_pad_2_array_right_1.xmin,h_pad_2_array_right_1.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i/2 * self.pad_pitch), width = self.bar_width, orientation = 180, name=f"pr{i}"))
+                t1 = device.add_ref(text_label(str(i), self.text_size, 3, 0, self.hierarchical))
+                t1.move(origin=(t1.xmax, t1.center[1]), destination=(left_xmin - 20, left_ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i/2 * self.pad_pitch))
             else:
-                left_ports.append(device.add_port(midpoint = (h_pad_2_array_left_2.xmax,h_pad_2_array_left_2.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + (i-1)/2 * self.pad_pitch), width = self.bar_width, orientation = 0, name=f"pl{i}"))
-                right_ports.append(device.add_port(midpoint = (h_pad_2_array_right_2.xmin,h_pad_2_array_right_2.ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + (i-1)/2 * self.pad_pitch), width = self.bar_width, orientation = 180, name=f"pr{i}"))
-
-        # text labels
+                t2 = device.add_ref(text_label(str(i), self.text_size, 3, 0, self.hierarchical))
+                t2.move(origin=(t2.xmin, t2.center[1]), destination=(right_xmax + 20, right_ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + (i-1)/2 * self.pad_pitch))
+
+    def draw_labels_double(self, device, pads):
+        (bottom_xmin, bottom_ymin), _ = pads[0].bbox
+        (top_xmin, _), (_, top_ymax) = pads[1].bbox
+        (left_xmin, left_ymin), _ = pads[4].bbox
+        _, (right_xmax, _) = pads[5].bbox
         for i in range(self.num_bars[0]):
-            t1 = pg.text(text=str(i), size=self.text_size, justify='left', layer=4).rotate(90)
-            t1.move(origin=(t1.center[0], t1.ymax), destination=(v_pad_1_array_bottom_1.xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch/2, v_pad_1_array_bottom_2.ymin - 20))
-            t2 = pg.text(text=str(i), size=self.text_size, justify='left', layer=4).rotate(90)
-            t2.move(origin=(t2.center[0], t2.ymin), destination=(v_pad_1_array_top_1.xmin + self.pad_dimensions[0]/2 + + self.pad_dimensions[2] + i * self.pad_pitch/2, v_pad_1_array_top_1.ymax + 20))
-            device.add_ref(t1)
-            device.add_ref(t2)
+            t1 = device.add_ref(text_label(str(i), self.text_size, 4, 90, self.hierarchical))
+            t1.move(origin=(t1.center[0], t1.ymax), destination=(bottom_xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch, bottom_ymin - 20))
+            t2 = device.add_ref(text_label(str(i), self.text_size, 4, 90, self.hierarchical))
+            t2.move(origin=(t2.center[0], t2.ymin), destination=(top_xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch, top_ymax + 20))
         for i in range(self.num_bars[1]):
-            t1 = pg.text(text=str(i), size=self.text_size, justify='left', layer=3)
-            t1.move(origin=(t1.xmax, t1.center[1]), destination=(h_pad_2_array_left_2.xmin - 20, h_pad_2_array_left_1.ymin + self.pad_dimensions[0]/2 + i * self.pad_pitch/2))
-            t2 = pg.text(text=str(i), size=self.text_size, justify='left', layer=3)
-            t2.move(origin=(t2.xmin, t2.center[1]), destination=(h_pad_2_array_right_1.xmax + 20, h_pad_2_array_left_1.ymin + self.pad_dimensions[0]/2 + i * self.pad_pitch/2))
-            device.add_ref(t1)
-            device.add_ref(t2)
+            t1 = device.add_ref(text_label(str(i), self.text_size, 3, 0, self.hierarchical))
+            t1.move(origin=(t1.xmax, t1.center[1]), destination=(left_xmin - 20, left_ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch))
+            t2 = device.add_ref(text_label(str(i), self.text_size, 3, 0, self.hierarchical))
+            t2.move(origin=(t2.xmin, t2.center[1]), destination=(right_xmax + 20, left_ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch))
 
-        return [v_pad_1_array_bottom_1, v_pad_1_array_bottom_2, v_pad_1_array_top_1, v_pad_1_array_top_2, v_pad_4_array_bottom_1, v_pad_4_array_bottom_2, v_pad_4_array_top_1, v_pad_4_array_top_2, h_pad_2_array_left_1, h_pad_2_array_left_2, h_pad_2_array_right_1, h_pad_2_array_right_2, h_pad_5_array_left_1, h_pad_5_array_left_2, h_pad_5_array_right_1, h_pad_5_array_right_2], [bottom_ports, top_ports, left_ports, right_ports]
- 
-    def route_pads_double(self, device, be, bar_ports, pad_ports, thetas):
+    def draw_labels_single_line(self, device, pads):
+        (_, right_ymin), (right_xmax, _) = pads[0].bbox
+        for i in range(self.num_bars[0] + self.num_bars[1]):
+
+            if i < self.num_bars[0]:
+                t = device.add_ref(text_label("v" + str(i), self.text_size, 3, 0, self.hierarchical))
+            else:
+                t = device.add_ref(text_label("h" + str(i-self.num_bars[0]), self.text_size, 3, 0, self.hierarchical))
+            t.move(origin=(t.xmin, t.center[1]), destination=(right_xmax + 20, right_ymin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch))
+
+    def draw_labels_interleaved(self, device, pads):
+        (bottom_1_xmin, _), _ = pads[0].bbox
+        (_, bottom_2_ymin), _ = pads[1].bbox
+        (top_1_xmin, _), (_, top_1_ymax) = pads[2].bbox
+        (_, left_1_ymin), _ = pads[8].bbox
+        (left_2_xmin, _), _ = pads[9].bbox
+        _, (right_1_xmax, _) = pads[10].bbox
         for i in range(self.num_bars[0]):
-            dx = abs(bar_ports[0][i].midpoint[0] - pad_ports[0][i].midpoint[0])
-            dy = abs(bar_ports[0][i].midpoint[1] - pad_ports[0][i].midpoint[1])
-            offset = dy - self.pad_route_dist - dx / np.tan(thetas[0])
-            be.add_ref(pr.route_sharp(pad_ports[0][i], bar_ports[0][i], path_type="Z", length1=self.pad_route_dist, length2=offset, layer=1))
-            be.add_ref(pr.route_sharp(pad_ports[1][i], bar_ports[1][i], path_type="Z", length1=self.pad_route_dist, length2=offset, layer=1))
-        
+            t1 = device.add_ref(text_label(str(i), self.text_size, 4, 90, self.hierarchical))
+            t1.move(origin=(t1.center[0], t1.ymax), destination=(bottom_1_xmin + self.pad_dimensions[0]/2 + self.pad_dimensions[2] + i * self.pad_pitch/2, bottom_2_ymin - 20))
+            t2 = device.add_ref(text_label(str(i), self.text_size, 4, 90, self.hierarchical))
+            t2.move(origin=(t2.center[0], t2.ymin), destination=(top_1_xmin + self.pad_dimensions[0]/2 + + self.pad_dimensions[2] + i * self.pad_pitch/2, top_1_ymax + 20))
         for i in range(self.num_bars[1]):
-            dx = abs(bar_ports[2][i].midpoint[0] - pad_ports[2][i].midpoint[0])
-            dy = abs(bar_ports[2][i].midpoint[1] - pad_ports[2][i].midpoint[1])
-            offset = dx - self.pad_route_dist - dy / np.tan(thetas[1])
-            device.add_ref(pr.route_sharp(pad_ports[2][i], bar_ports[2][i], path_type="Z", length1=self.pad_route_dist, length2=offset, layer=3))
-            device.add_ref(pr.route_sharp(pad_ports[3][i], bar_ports[3][i], path_type="Z", length1=self.pad_route_dist, length2=offset, layer=3))
+            t1 = device.add_ref(text_label(str(i), self.text_size, 3, 0, self.hierarchical))
+            t1.move(origin=(t1.xmax, t1.center[1]), destination=(left_2_xmin - 20, left_1_ymin + self.pad_dimensions[0]/2 + i * self.pad_pitch/2))
+            t2 = device.add_ref(text_label(str(i), self.text_size, 3, 0, self.hierarchical))
+            t2.move(origin=(t2.xmin, t2.center[1]), destination=(right_1_xmax + 20, left_1_ymin + self.pad_dimensions[0]/2 + i * self.pad_pitch/2))
+
+    def route_offsets(self, pad, bar, theta, vertical):
+        dx = np.abs(bar.midpoints[:, 0] - pad.midpoints[:, 0])
+        dy = np.abs(bar.midpoints[:, 1] - pad.midpoints[:, 1])
+        if vertical:
+            return dy - self.pad_route_dist - dx / np.tan(theta), dx == 0
+        return dx - self.pad_route_dist - dy / np.tan(theta), dy == 0
+
+    def route_batch(self, pad, bar, layer, length1, length2, manhattan=None):
+        # routes pad and bar port tables row by row and records the waypoints for the netlist
+        n = len(pad)
+        z = np.ones(n, dtype=bool) if manhattan is None else ~manhattan
+        paths = []
+        polygons = route_polygons(*pad[z].arrays(), *bar[z].arrays(), path_type="Z",
+                                  length1=np.broadcast_to(length1, n)[z], length2=np.broadcast_to(length2, n)[z], paths=paths)
+        groups = [(np.flatnonzero(z)[index], waypoints) for index, waypoints in paths]
+        if manhattan is not None:
+            paths = []
+            polygons += route_polygons(*pad[manhattan].arrays(), *bar[manhattan].arrays(), path_type="manhattan", paths=paths)
+            groups += [(np.flatnonzero(manhattan)[index], waypoints) for index, waypoints in paths]
+        for rows, waypoints in groups:
+            self.route_records.append(route_record(pad[rows], bar[rows], layer, waypoints, pad.widths[rows], bar.widths[rows]))
+        return polygons
+
+    def route_batches(self, bar_ports, pad_ports, thetas = None):
+        # the batches route_pads_<pad_style> routes, as (layer, pads, bars, length1, offset, manhattan);
+        # preflight.py checks the same batches without drawing them
+        thetas = self.route_thetas if thetas is None else thetas
+        bar, pad = bar_ports, pad_ports
+        if self.pad_style == "double":
+            v, _ = self.route_offsets(pad[0], bar[0], thetas[0], vertical=True)
+            h, _ = self.route_offsets(pad[2], bar[2], thetas[1], vertical=False)
+            return [(1, pad[0], bar[0], self.pad_route_dist, v, None), (1, pad[1], bar[1], self.pad_route_dist, v, None),
+                    (3, pad[2], bar[2], self.pad_route_dist, h, None), (3, pad[3], bar[3], self.pad_route_dist, h, None)]
+        if self.pad_style == "single":
+            # even bars route to the bottom/left pads, odd bars to the top/right pads
+            bar = [bar[0][0::2], bar[1][1::2], bar[2][0::2], bar[3][1::2]]
+            batches = []
+            for side in range(4):
+                offset, manhattan = self.route_offsets(pad[side], bar[side], thetas[side // 2], vertical=side < 2)
+                batches.append((1 if side < 2 else 3, pad[side], bar[side], self.pad_route_dist, offset, manhattan))
+            return batches
+        if self.pad_style == "interleaved":
+            # even bars take their offset from the inner row of bottom/left pads, odd bars from the inner row of top/right pads
+            outer_route_dist = self.pad_route_dist + self.interleaved_pad_spacing + self.pad_dimensions[1] + 2 * self.pad_dimensions[2]
+            batches = []
+            for layer, first, theta, vertical in [(1, 0, thetas[0], True), (3, 2, thetas[1], False)]:
+                even = np.arange(len(bar[first])) % 2 == 0
+                offset = np.where(even, self.route_offsets(pad[first], bar[first], theta, vertical)[0], self.route_offsets(pad[first + 1], bar[first + 1], theta, vertical)[0])
+                batches.append((layer, pad[first], bar[first], np.where(even, self.pad_route_dist, outer_route_dist), offset, None))
+                batches.append((layer, pad[first + 1], bar[first + 1], np.where(even, outer_route_dist, self.pad_route_dist), offset, None))
+            return batches
+        if self.pad_style == "single_line":
+            # one column of pads on the right, the first num_bars[0] for the vertical bars
+            v_pad, h_pad = pad[:self.num_bars[0]], pad[self.num_bars[0]:]
+            offset, manhattan = self.route_offsets(h_pad, bar[3], thetas[1], vertical=False)
+            return [(1, v_pad, bar[0], None, None, np.ones(self.num_bars[0], dtype=bool)),
+                    (3, h_pad, bar[3], self.pad_route_dist, offset, manhattan)]
+        raise ValueError("Invalid pad style")
+
+    def route_layers(self, device, be, batches):
+        # one route cell per layer, the vertical bars' routes (layer 1) on the back end
+        for layer, part in [(1, be), (3, device)]:
+            polygons = []
+            for batch_layer, pad, bar, length1, offset, manhattan in batches:
+                if batch_layer == layer:
+                    polygons += self.route_batch(pad, bar, layer, length1, offset, manhattan)
+            part.add_ref(route_device(polygons, layer=layer, hierarchical=self.hierarchical))
+
+    def route_pads_double(self, device, be, bar_ports, pad_ports, thetas):
+        self.route_layers(device, be, self.route_batches(bar_ports, pad_ports, thetas))
 
     def route_pads_single(self, device, be, bar_ports, pad_ports, thetas):
         h_extender = pg.rectangle(size = (self.bar_width, self.bar_width), layer = 3)
         h_extender_array_1 = device.add_array(h_extender, columns = 1, rows = np.ceil(self.num_bars[1]//2), spacing = (0, self.bar_pitch * 2))
         h_extender_array_2 = device.add_array(h_extender, columns = 1, rows = np.floor(self.num_bars[1]//2), spacing = (0, self.bar_pitch * 2))
-        h_extender_array_1.move(origin=(h_extender_array_1.xmin, h_extender_array_1.ymin + self.bar_width/2), destination=bar_ports[3][0].midpoint)
-        h_extender_array_2.move(origin=(h_extender_array_2.xmax, h_extender_array_2.ymin + self.bar_width/2), destination=bar_ports[2][1].midpoint)
+        h_extender_array_1.move(origin=(h_extender_array_1.xmin, h_extender_array_1.ymin + self.bar_width/2), destination=bar_ports[3].midpoints[0])
+        h_extender_array_2.move(origin=(h_extender_array_2.xmax, h_extender_array_2.ymin + self.bar_width/2), destination=bar_ports[2].midpoints[1])
 
         v_extender = pg.rectangle(size = (self.bar_width, self.bar_width), layer = 1)
         v_extender_array_1 = be.add_array(v_extender, rows=1, columns=np.ceil(self.num_bars[0]//2), spacing=(self.bar_pitch * 2, 0))
         v_extender_array_2 = be.add_array(v_extender, rows=1, columns=np.floor(self.num_bars[0]//2), spacing=(self.bar_pitch * 2, 0))
-        v_extender_array_1.move(origin=(v_extender_array_1.xmin + self.bar_width/2, v_extender_array_1.ymin), destination=bar_ports[1][0].midpoint)
-        v_extender_array_2.move(origin=(v_extender_array_2.xmin + self.bar_width/2, v_extender_array_2.ymax), destination=bar_ports[0][1].midpoint)
-        
-        for i in range(self.num_bars[0]):
-            if i % 2 == 0:
-                dx = abs(bar_ports[0][i].midpoint[0] - pad_ports[0][i//2].midpoint[0])
-                dy = abs(bar_ports[0][i].midpoint[1] - pad_ports[0][i//2].midpoint[1])
-                offset = dy - self.pad_route_dist - dx / np.tan(thetas[0])
-                if dx == 0:
-                    be.add_ref(pr.route_sharp(pad_ports[0][i//2], bar_ports[0][i], path_type="manhattan", layer=1))
-                else:
-                    be.add_ref(pr.route_sharp(pad_ports[0][i//2], bar_ports[0][i], path_type="Z", length1=self.pad_route_dist, length2=offset, layer=1))
-            else:
-                dx = abs(bar_ports[1][i].midpoint[0] - pad_ports[1][(i-1)//2].midpoint[0])
-                dy = abs(bar_ports[1][i].midpoint[1] - pad_ports[1][(i-1)//2].midpoint[1])
-                offset = dy - self.pad_route_dist - dx / np.tan(thetas[0])
-                if dx == 0:
-                    be.add_ref(pr.route_sharp(pad_ports[1][(i-1)//2], bar_ports[1][i], path_type="manhattan", layer=1))
-                else:
-                    be.add_ref(pr.route_sharp(pad_ports[1][(i-1)//2], bar_ports[1][i], path_type="Z", length1=self.pad_route_dist, length2=offset, layer=1))
-        
-        for i in range(self.num_bars[1]):
-            if i % 2 == 0:
-                dx = abs(bar_ports[2][i].midpoint[0] - pad_ports[2][i//2].midpoint[0])
-                dy = abs(bar_ports[2][i].midpoint[1] - pad_ports[2][i//2].midpoint[1])
-                offset = dx - self.pad_route_dist - dy / np.tan(thetas[1])
-                if dy == 0:
-                    device.add_ref(pr.route_sharp(pad_ports[2][i//2], bar_ports[2][i], path_type="manhattan", layer=3))
-                else:
-                    device.add_ref(pr.route_sharp(pad_ports[2][i//2], bar_ports[2][i], path_type="Z", length1=self.pad_route_dist, length2=offset, layer=3))
-            else:
-                dx = abs(bar_ports[3][i].midpoint[0] - pad_ports[3][(i-1)//2].midpoint[0])
-                dy = abs(bar_ports[3][i].midpoint[1] - pad_ports[3][(i-1)//2].midpoint[1])
-                offset = dx - self.pad_route_dist - dy / np.tan(thetas[1])
-                if dy == 0:
-                    device.add_ref(pr.route_sharp(pad_ports[3][(i-1)//2], bar_ports[3][i], path_type="manhattan", layer=3))
-                else:
-                    device.add_ref(pr.route_sharp(pad_ports[3][(i-1)//2], bar_ports[3][i], path_type="Z", length1=self.pad_route_dist, length2=offset, layer=3))
-
-    def route_pads_interleaved(self, device, be, bar_ports, pad_ports, thetas):
-        for i in range(self.num_bars[0]):
-            if i % 2 == 0:
-                dx = abs(bar_ports[0][i].midpoint[0] - pad_ports[0][i].midpoint[0])
-                dy = abs(bar_ports[0][i].midpoint[1] - pad_ports[0][i].midpoint[1])
-                offset = dy - self.pad_route_dist - dx / np.tan(thetas[0])
-                be.add_ref(pr.route_sharp(pad_ports[0][i], bar_ports[0][i], path_type="Z", length1=self.pad_route_dist, length2=offset, layer=1))
-                be.add_ref(pr.route_sharp(pad_ports[1][i], bar_ports[1][i], path_type="Z", length1=self.pad_route_dist + self.interleaved_pad_spacing + self.pad_dimensions[1] + 2 * self.pad_dimensions[2], length2=offset, layer=1))
-
-            else:
-                dx = abs(bar_ports[1][i].midpoint[0] - pad_ports[1][i].midpoint[0])
-                dy = abs(bar_ports[1][i].midpoint[1] - pad_ports[1][i].midpoint[1])
-                offset = dy - self.pad_route_dist - dx / np.tan(thetas[0])
-                be.add_ref(pr.route_sharp(pad_ports[1][i], bar_ports[1][i], path_type="Z", length1=self.pad_route_dist, length2=offset, layer=1))
-                be.add_ref(pr.route_sharp(pad_ports[0][i], bar_ports[0][i], path_type="Z", length1=self.pad_route_dist + self.interleaved_pad_spacing + self.pad_dimensions[1] + 2 * self.pad_dimensions[2], length2=offset, layer=1))
+        v_extender_array_1.move(origin=(v_extender_array_1.xmin + self.bar_width/2, v_extender_array_1.ymin), destination=bar_ports[1].midpoints[0])
+        v_extender_array_2.move(origin=(v_extender_array_2.xmin + self.bar_width/2, v_extender_array_2.ymax), destination=bar_ports[0].midpoints[1])
 
-        
-        for i in range(self.num_bars[1]):
-            if i % 2 == 0:
-                dx = abs(bar_ports[2][i].midpoint[0] - pad_ports[2][i].midpoint[0])
-                dy = abs(bar_ports[2][i].midpoint[1] - pad_ports[2][i].midpoint[1])
-                offset = dx - self.pad_route_dist - dy / np.tan(thetas[1])
-                device.add_ref(pr.route_sharp(pad_ports[2][i], bar_ports[2][i], path_type="Z", length1=self.pad_route_dist, length2=offset, layer=3))
-                device.add_ref(pr.route_sharp(pad_ports[3][i], bar_ports[3][i], path_type="Z", length1=self.pad_route_dist + self.interleaved_pad_spacing + self.pad_dimensions[1] + 2 * self.pad_dimensions[2], length2=offset, layer=3))
+        self.route_layers(device, be, self.route_batches(bar_ports, pad_ports, thetas))
 
-            else:
-                dx = abs(bar_ports[3][i].midpoint[0] - pad_ports[3][i].midpoint[0])
-                dy = abs(bar_ports[3][i].midpoint[1] - pad_ports[3][i].midpoint[1])
-                offset = dx - self.pad_route_dist - dy / np.tan(thetas[1])
-                device.add_ref(pr.route_sharp(pad_ports[3][i], bar_ports[3][i], path_type="Z", length1=self.pad_route_dist, length2=offset, layer=3))
-                device.add_ref(pr.route_sharp(pad_ports[2][i], bar_ports[2][i], path_type="Z", length1=self.pad_route_dist + self.interleaved_pad_spacing + self.pad_dimensions[1] + 2 * self.pad_dimensions[2], length2=offset, layer=3))
+    def route_pads_interleaved(self, device, be, bar_ports, pad_ports, thetas):
+        self.route_layers(device, be, self.route_batches(bar_ports, pad_ports, thetas))
 
     def route_pads_single_line(self, device, be, bar_ports, pad_ports, thetas):
         h_extender = pg.rectangle(size = (self.bar_width, self.bar_width), layer = 3)
         h_extender_array = device.add_array(h_extender, columns = 1, rows = self.num_bars[1], spacing = (0, self.bar_pitch))
-        h_extender_array.move(origin=(h_extender_array.xmax, h_extender_array.ymin + self.bar_width/2), destination=bar_ports[2][0].midpoint)
+        h_extender_array.move(origin=(h_extender_array.xmax, h_extender_array.ymin + self.bar_width/2), destination=bar_ports[2].midpoints[0])
 
         v_extender = pg.rectangle(size = (self.bar_width, self.bar_width), layer = 1)
         v_extender_array = be.add_array(v_extender, rows=1, columns=self.num_bars[0], spacing=(self.bar_pitch, 0))
-        v_extender_array.move(origin=(v_extender_array.xmin + self.bar_width/2, v_extender_array.ymin), destination=bar_ports[1][0].midpoint)
+        v_extender_array.move(origin=(v_extender_array.xmin + self.bar_width/2, v_extender_array.ymin), destination=bar_ports[1].midpoints[0])
 
-
-        for i in range(self.num_bars[0]):
-            be.add_ref(pr.route_sharp(pad_ports[i], bar_ports[0][i], path_type="manhattan", layer=1)) 
-
-        for i in range(self.num_bars[1]):
-            dx = abs(bar_ports[3][i].midpoint[0] - pad_ports[i+self.num_bars[0]].midpoint[0])
-            dy = abs(bar_ports[3][i].midpoint[1] - pad_ports[i+self.num_bars[0]].midpoint[1])
-            offset = dx - self.pad_route_dist - dy / np.tan(thetas[1])
-            if dy == 0:
-                device.add_ref(pr.route_sharp(pad_ports[i+self.num_bars[0]], bar_ports[3][i], path_type="manhattan", layer=3))
-            else:
-                device.add_ref(pr.route_sharp(pad_ports[i+self.num_bars[0]], bar_ports[3][i], path_type="Z", length1=self.pad_route_dist, length2=offset, layer=3))
+        self.route_layers(device, be, self.route_batches(bar_ports, pad_ports, thetas))
     
-    def draw(self, show_ports = False, show_subports = False, single_pad_offsets = [0, 0, 0, 0]):
-        set_quickplot_options(show_ports = show_ports, show_subports = show_subports)
-        bars, bar_ports = self.draw_bars(self.device, self.be)
-        circles = self.draw_circles(self.device)
-        if self.pad_style == "double":
-            pads, pad_ports = self.draw_pads_double(self.device, self.be)
-            self.route_pads_double(self.device, self.be, bar_ports, pad_ports, self.route_thetas)
-
-        elif self.pad_style == "single":
-            pads, pad_ports = self.draw_pads_single(self.device, self.be, single_pad_offsets)
-            self.route_pads_single(self.device, self.be, bar_ports, pad_ports, self.route_thetas)
-        elif self.pad_style == "interleaved":
-            pads, pad_ports = self.draw_pads_interleaved(self.device, self.be)
-            self.route_pads_interleaved(self.device, self.be, bar_ports, pad_ports, self.route_thetas)
-
-        elif self.pad_style == "single_line":
-            pads, pad_ports = self.draw_pads_single_line(self.device, self.be)
-            self.route_pads_single_line(self.device, self.be, bar_ports, pad_ports, self.route_thetas)
-            be_ref = self.device.add_ref(self.be)
+    def invert(self, bbox, be, invert_mode, invert_tiles, invert_workers):
+        if invert_mode == "full":
+            return pg.boolean(bbox, be, operation = 'A-B', layer=1)
+        elif invert_mode == "tiled":
+            return invert_tiled(bbox.bbox, be, num_tiles = invert_tiles, workers = invert_workers, layer = 1)
+        else:
+            raise ValueError("Invalid invert mode")
+
+    def build_bars(self):
+        device, be = Device("bars"), Device("bars_be")
+        bars, bar_ports = self.draw_bars(device, be)
+        return device, be, bars, bar_ports
+
+    def build_circles(self):
+        device = Device("circles")
+        self.draw_circles(device)
+        return device
+
+    def build_pads(self, bars):
+        device, be = Device("pads"), Device("pads_be")
+        if self.pad_style == "single":
+            pads, pad_ports = self.draw_pads_single(device, be, self.single_pad_offsets)
+        elif self.pad_style in ["double", "interleaved", "single_line"]:
+            pads, pad_ports = getattr(self, "draw_pads_" + self.pad_style)(device, be)
         else:
             raise ValueError("Invalid pad style")
-        
-        if self.pad_style != "single_line":
-            if self.invert_be:
-                bbox = pg.rectangle(size = (self.device.xsize + 20, self.be.ysize + 20), layer = 0)
-                bbox.move(origin=bbox.center, destination=(0, 0))
-                inverted = pg.boolean(bbox, self.be, operation = 'A-B', layer=1)
-                self.device.add_ref(inverted)
+        return device, be, pads, pad_ports
+
+    def build_labels(self, pads):
+        device = Device("labels")
+        getattr(self, "draw_labels_" + self.pad_style)(device, pads[2])
+        return device
+
+    def build_routes(self, bars, pads):
+        # the net table is filled by route_batch while the routes are drawn
+        device, be = Device("routes"), Device("routes_be")
+        self.route_records = []
+        getattr(self, "route_pads_" + self.pad_style)(device, be, bars[3], pads[3], self.route_thetas)
+        nets = netlist.from_records(self.route_records)
+        self.route_records = []
+        return device, be, nets
+
+    def build_inversion(self, bars, pads, routes, size, center):
+        be = Device("be")
+        for part in [bars, pads, routes]:
+            be.add_ref(part[1])
+        bbox = pg.rectangle(size = size, layer = 0)
+        bbox.move(origin=bbox.center, destination=center)
+        return self.invert(bbox, be, self.invert_mode, self.invert_tiles, self.invert_workers)
+
+    def stage(self, name, *args):
+        # reuses the last output of a stage as long as its params, its upstream stages and args are unchanged
+        names, upstream = self.STAGES[name]
+        payload = [normalize({k: getattr(self, k) for k in names}), [self.stages[u][0] for u in upstream], [normalize(a) for a in args]]
+        key = hashlib.sha256(json.dumps(payload).encode()).hexdigest()
+        if name not in self.stages or self.stages[name][0] != key:
+            inputs = [self.stages[u][1] for u in upstream]
+            if self.profiler is None:
+                output = getattr(self, "build_" + name)(*inputs, *args)
             else:
-                self.device.add_ref(self.be)
+                output = self.profiler.run(name, self.pad_style, getattr(self, "build_" + name), *inputs, *args)
+            self.stages[name] = (key, output)
+            self.rebuilt.append(name)
+        return self.stages[name][1]
+
+    def build(self, single_pad_offsets = [0, 0, 0, 0], invert_mode = "full", invert_tiles = [8, 8], invert_workers = 1, hierarchical = False):
+        self.set_options(single_pad_offsets = single_pad_offsets, invert_mode = invert_mode, invert_tiles = invert_tiles,
+                         invert_workers = invert_workers, hierarchical = hierarchical)
+        self.rebuilt = []
+        bars = self.stage("bars")
+        circles = self.stage("circles")
+        pads = self.stage("pads")
+        labels = self.stage("labels")
+        routes = self.stage("routes")
+
+        # assembled on the side, so a failing build leaves the last device in place
+        device, be = self.assemble(bars, circles, pads, labels, routes)
+        if not self.invert_be:
+            device.add_ref(be)
         else:
-            if self.invert_be:
-                bbox = pg.rectangle(size = (self.device.xsize + 20, self.device.ysize + 20), layer = 0)
-                bbox.move(origin=bbox.center, destination=self.device.center)
-                inverted = pg.boolean(bbox, self.be, operation = 'A-B', layer=1)
-                self.device.add_ref(inverted)
-                self.device.remove(be_ref)
-        
+            device.add_ref(self.stage("inversion", *self.inversion_bbox([bounding_box(device)], [bounding_box(be)])))
+        self.device, self.be = device, be
+
+    def assemble(self, bars, circles, pads, labels, routes):
+        # the device and back end of a build from its stage outputs, before the back end or its
+        # inversion is added to the device
+        device, be = Device(), Device()
+        for part in [bars, pads, routes]:
+            device.add_ref(part[0])
+            be.add_ref(part[1])
+        device.add_ref(circles)
+        device.add_ref(labels)
+        return device, be
+
+    def flat_device(self):
+        # the device a non-hierarchical build() with the same params and options draws. Only the
+        # labels and routes are drawn differently, so they are redrawn on a copy and every other
+        # stage is reused as built, the inversion too: it holds the same polygons either way
+        flat = copy.copy(self)
+        flat.stages, flat.rebuilt, flat.profiler = dict(self.stages), [], None
+        flat.set_options(**dict(self.options, hierarchical = False))
+        bars, circles, pads = flat.stage("bars"), flat.stage("circles"), flat.stage("pads")
+        device, be = flat.assemble(bars, circles, pads, flat.stage("labels"), flat.stage("routes"))
+        if not self.invert_be:
+            device.add_ref(be)
+        elif "inversion" in self.stages:
+            device.add_ref(self.stages["inversion"][1])
+        else:
+            # a loaded array has no stages to reuse
+            device.add_ref(flat.stage("inversion", *flat.inversion_bbox([bounding_box(device)], [bounding_box(be)])))
+        return device
+
+    def set_options(self, single_pad_offsets = [0, 0, 0, 0], invert_mode = "full", invert_tiles = [8, 8], invert_workers = 1, hierarchical = False):
+        self.options = {"single_pad_offsets": single_pad_offsets, "invert_mode": invert_mode, "invert_tiles": invert_tiles,
+                        "invert_workers": invert_workers, "hierarchical": hierarchical}
+        for k, v in self.options.items():
+            setattr(self, k, v)
+
+    def inversion_bbox(self, device_bboxes, be_bboxes):
+        # (size, center) of the inverted area from the bounds of the front and back end parts
+        device_bbox, be_bbox = np.concatenate(device_bboxes), np.concatenate(be_bboxes)
+        if self.pad_style != "single_line":
+            return (device_bbox[:, 0].max() - device_bbox[:, 0].min() + 20, be_bbox[:, 1].max() - be_bbox[:, 1].min() + 20), (0, 0)
+        # single_line inverts the bounding box of the whole array, back end included
+        bbox = np.concatenate([device_bbox, be_bbox])
+        return bbox.max(axis=0) - bbox.min(axis=0) + 20, (bbox.max(axis=0) + bbox.min(axis=0)) / 2
+
+    def update(self, **changes):
+        # changes params and/or build options, then rebuilds only the stages that depend on them;
+        # the changes are only kept once the rebuild succeeds
+        option_names = inspect.signature(self.set_options).parameters
+        unknown = [k for k in changes if k not in self.PARAMS and k not in option_names]
+        if unknown:
+            raise ValueError(f"Unknown params or build options: {', '.join(unknown)}")
+        options = dict(self.options)
+        options.update({k: v for k, v in changes.items() if k in option_names})
+        params = dict(self.params, **{k: v for k, v in changes.items() if k in self.PARAMS})
+        old_params, old_options, old_rebuilt = self.params, dict(self.options), self.rebuilt
+        try:
+            self.set_params(params)
+            self.build(**options)
+        except Exception:
+            self.set_params(old_params)
+            for k, v in old_options.items():
+                setattr(self, k, v)
+            self.options, self.rebuilt = old_options, old_rebuilt
+            raise
+        self.params = params
+
+    @contextmanager
+    def profile(self, cprofile = False, callback = None):
+        # instruments every build inside the block, the report is left in self.profile_report
+        self.profiler = stage_profiler(cprofile, callback)
+        try:
+            yield self.profiler
+        finally:
+            self.profiler.stop()
+            self.profile_report = self.profiler.report()
+            self.profiler = None
+
+    def stage_output(self, name):
+        # output of a stage of the last build; an array reopened by load() has the GDS but no stages
+        if name not in self.stages:
+            raise ValueError(f"The {name} stage has not been built; arrays opened with load() need build(**array.options) first")
+        return self.stages[name][1]
+
+    def net_tables(self, routes, bar_ports, sheet_resistance = None):
+        nets = routes.with_bars(bar_ports, self.bar_width, self.bar_lengths, self.circle_radius)
+        return nets if sheet_resistance is None else nets.with_resistance(sheet_resistance)
+
+    def netlist(self, sheet_resistance = None):
+        # route, bar and crosspoint tables of the last build; given sheet resistances (a number or
+        # {layer: ohms per square}) they include resistance estimates
+        return self.net_tables(self.stage_output("routes")[2], self.stage_output("bars")[3], sheet_resistance)
+
+    def port_tables(self):
+        # (bar_ports, pad_ports) of the last build, or of the files the array was loaded from
+        if self.loaded_ports is not None:
+            return self.loaded_ports
+        return self.stage_output("bars")[3], self.stage_output("pads")[3]
+
+    def add_ports(self):
+        # materializes the port tables as phidl Ports, bottom/top ports on be and left/right ports on device
+        bar_ports, pad_ports = self.port_tables()
+        ports = port_table.concatenate(bar_ports + (pad_ports if isinstance(pad_ports, list) else [pad_ports]))
+        vertical = np.isin(ports.side, ["b", "t", "pb", "pt"])
+        ports[vertical].add_to(self.be)
+        ports[~vertical].add_to(self.device)
+
+    def stream(self, directory, filename, compress = False, nets = None, sheet_resistance = None, invert_mode = "tiled", **build_kwargs):
+        # builds the array stage by stage and writes each stage's cells as soon as it is drawn,
+        # so the full layout is never held in memory; streamed builds are not memoized. An
+        # inverted back end is kept as per-stage NumPy geometry (inversion.geometry) and clipped
+        # one tile at a time, so invert_mode="full", which gathers the whole back end into one
+        # pg.boolean, is refused. The drawing is done on a copy with its own options: the last
+        # build(), its stages and the options save() records for it are left as they were.
+        if invert_mode != "tiled":
+            raise ValueError(f"stream() only inverts in tiles, got invert_mode {invert_mode!r}; use build() and save() for other modes")
+        array = copy.copy(self)
+        array.set_options(invert_mode = invert_mode, **build_kwargs)
+        path = gds_path(directory, filename, compress)
+        with gds_stream(path, compress = compress) as stream:
+            stream.reserve(filename)
+            device_names, device_bboxes, be_names, be_bboxes, be_parts = [], [], [], [], []
+
+            def write(device, names, bboxes):
+                if names is not None:
+                    names.append(stream.write(device))
+                bbox = bounding_box(device)
+                if bbox is not None:
+                    bboxes.append(bbox)
+
+            def write_be(device):
+                # an inverted back end is only needed for its geometry
+                write(device, None if array.invert_be else be_names, be_bboxes)
+                if array.invert_be:
+                    be_parts.extend(geometry(device))
+
+            bars = array.build_bars()
+            write(bars[0], device_names, device_bboxes)
+            write_be(bars[1])
+            write(array.build_circles(), device_names, device_bboxes)
+            pads = array.build_pads(bars)
+            write(pads[0], device_names, device_bboxes)
+            write_be(pads[1])
+            write(array.build_labels(pads), device_names, device_bboxes)
+            routes = array.build_routes(bars, pads)
+            save_layout(layout_path(directory, filename), path, array.params, array.options)
+            if nets is not None:
+                array.net_tables(routes[2], bars[3], sheet_resistance).save(os.path.join(directory, filename), nets)
+            write(routes[0], device_names, device_bboxes)
+            write_be(routes[1])
+            del bars, pads, routes
+
+            if not array.invert_be:
+                device_names.append(stream.write_references(stream.unique("be"), be_names))
+            else:
+                size, center = array.inversion_bbox(device_bboxes, be_bboxes)
+                bbox = pg.rectangle(size = size, layer = 0)
+                bbox.move(origin=bbox.center, destination=center)
+                # every tile becomes its own cell, written as soon as it is clipped
+                tiles = []
+                for polygons in invert_tiles(bbox.bbox, be_parts, num_tiles = array.invert_tiles, workers = array.invert_workers):
+                    if len(polygons) > 0:
+                        tiles.append(stream.write(add_fractured(Device("invert_tile"), polygons, layer = 1)))
+                device_names.append(stream.write_references(stream.unique("invert"), tiles))
+            stream.write_references(filename, device_names)
+        return path
+
+    def preview(self, show_ports = False, show_subports = False):
+        if show_ports or show_subports:
+            self.add_ports()
+        # imported here so headless builds never load the matplotlib backend
+        from phidl import set_quickplot_options, quickplot as qp
+        set_quickplot_options(show_ports = show_ports, show_subports = show_subports)
         qp(self.device)
 
-    def save(self, directory, filename):
-        self.device.write_gds(os.path.join(directory, filename + ".gds"), cellname=filename)
\ No newline at end of file
+    def draw(self, show_ports = False, show_subports = False, single_pad_offsets = [0, 0, 0, 0], *, preview = False, **build_kwargs):
+        # the first three arguments keep their old positions, the plot is opt-in
+        self.build(single_pad_offsets = single_pad_offsets, **build_kwargs)
+        if preview:
+            self.preview(show_ports = show_ports, show_subports = show_subports)
+        elif show_ports or show_subports:
+            warnings.warn("show_ports and show_subports only apply to the preview, pass preview=True to plot the array", stacklevel = 2)
+
+    def save(self, directory, filename, report = False, nets = None, sheet_resistance = None, compress = False):
+        # nets = "npz" or "csv" writes the netlist of the build next to the GDS; the layout
+        # sidecar written with it is what load() reads back
+        tables = None if nets is None else self.netlist(sheet_resistance)
+        path = write_gds(self.device, gds_path(directory, filename, compress), filename, compress)
+        save_layout(layout_path(directory, filename), path, self.params, self.options)
+        if nets is not None:
+            tables.save(os.path.join(directory, filename), nets)
+        if report:
+            # compared with the default, non-hierarchical export of the same params and options
+            size, flat_size = os.path.getsize(path), os.path.getsize(path)
+            if self.hierarchical:
+                flat_size = gds_size(self.flat_device(), filename, compress)
+            return {"size": size, "flat_size": flat_size, "compression_ratio": flat_size / size}
+
+    @classmethod
+    def load(cls, directory, filename):
+        # reopens an array written by save() or stream() without redrawing it: the device comes
+        # from the GDS, the params and build options from the layout sidecar and the port tables
+        # from the params. The ports are added to the device, which holds the back end as well.
+        # The build stages are not restored, netlist() and drc.check() need a build() first
+        from preflight import bar_ports as analytic_bar_ports, pad_ports as analytic_pad_ports
+        path, params, options = load_layout(layout_path(directory, filename))
+        array = cls(params)
+        array.set_options(**options)
+        array.device = read_gds(path)
+        bar_ports, pad_ports = analytic_bar_ports(array), analytic_pad_ports(array)
+        array.loaded_ports = (bar_ports, pad_ports)
+        port_table.concatenate(bar_ports + (pad_ports if isinstance(pad_ports, list) else [pad_ports])).add_to(array.device)
+        return array
@@ -0,0 +1,359 @@
+from ports import port_table
+import numpy as np
+
+# Design-rule checks on the conductor geometry of a built diode_array: bars, pads
+# and routes (labels and vias are left out, and the back end is checked before
+# inversion). Candidate pairs come from spatial indexes over the edges (see
+# edge_pairs), so only nearby geometry is compared, and every distance test is
+# vectorized over all candidate pairs at once. Polygons are assigned to nets through the port tables:
+# net "v3" is vertical bar 3 with its routes and pads, "h3" horizontal bar 3.
+
+def bboxes(polygons):
+    return np.array([np.concatenate([p.min(axis=0), p.max(axis=0)]) for p in polygons]).reshape(-1, 4)
+
+def padded(polygons):
+    # repeating the last vertex adds zero length edges, which change no distance
+    k = max(len(p) for p in polygons)
+    out = np.empty((len(polygons), k, 2))
+    for i, p in enumerate(polygons):
+        out[i, :len(p)] = p
+        out[i, len(p):] = p[-1]
+    return out
+
+def grid_cells(bboxes, cell, origin):
+    # (x, y, index) of every grid cell each bounding box covers
+    lo = np.floor((bboxes[:, :2] - origin) / cell).astype(np.int64)
+    hi = np.floor((bboxes[:, 2:] - origin) / cell).astype(np.int64)
+    counts = hi - lo + 1
+    n = counts[:, 0] * counts[:, 1]
+    index = np.repeat(np.arange(len(bboxes)), n)
+    offset = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    return lo[index, 0] + offset % counts[index, 0], lo[index, 1] + offset // counts[index, 0], index
+
+def grid_pairs(a, b, distance, cell = None):
+    # index pairs (i, j) of bounding boxes a[i] and b[j] that come within distance of each other
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    a = a + np.array([-distance, -distance, distance, distance])
+    if cell is None:
+        cell = max(np.median(np.maximum(b[:, 2] - b[:, 0], b[:, 3] - b[:, 1])), distance, 1e-6)
+    origin = np.minimum(a[:, :2].min(axis=0), b[:, :2].min(axis=0))
+    ax, ay, ai = grid_cells(a, cell, origin)
+    bx, by, bi = grid_cells(b, cell, origin)
+    width = max(ax.max(), bx.max()) + 1
+    akey, bkey = ay * width + ax, by * width + bx
+    order = np.argsort(bkey, kind="stable")
+    bkey, bi = bkey[order], bi[order]
+    start, stop = np.searchsorted(bkey, akey, "left"), np.searchsorted(bkey, akey, "right")
+    n = stop - start
+    ia, cx, cy = np.repeat(ai, n), np.repeat(ax, n), np.repeat(ay, n)
+    ib = bi[np.repeat(start, n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)]
+    overlap = (a[ia, 0] <= b[ib, 2]) & (a[ia, 2] >= b[ib, 0]) & (a[ia, 1] <= b[ib, 3]) & (a[ia, 3] >= b[ib, 1])
+    ia, ib, cx, cy = ia[overlap], ib[overlap], cx[overlap], cy[overlap]
+    # boxes sharing several cells are only reported from the cell holding the lower left
+    # corner of their intersection
+    corner = np.floor((np.maximum(a[ia, :2], b[ib, :2]) - origin) / cell).astype(np.int64)
+    first = (corner[:, 0] == cx) & (corner[:, 1] == cy)
+    return ia[first], ib[first]
+
+def strip_pairs(a, b, distance, height):
+    # grid_pairs for boxes that are thin in y: rows of the given height, and a sweep along x
+    # within each row, so long boxes cost one entry per row rather than one per cell
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    a = a + np.array([-distance, -distance, distance, distance])
+    x0, y0 = min(a[:, 0].min(), b[:, 0].min()), min(a[:, 1].min(), b[:, 1].min())
+    span = max(a[:, 2].max(), b[:, 2].max()) - x0 + 1
+
+    def rows(boxes):
+        lo = np.floor((boxes[:, 1] - y0) / height).astype(np.int64)
+        n = np.floor((boxes[:, 3] - y0) / height).astype(np.int64) - lo + 1
+        index = np.repeat(np.arange(len(boxes)), n)
+        return lo[index] + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n), index
+
+    def starting_in(rows_q, q, boxes_q, rows_s, s, boxes_s, side):
+        # entries s in the same row as q whose x interval starts inside that of q
+        key = rows_s * span + boxes_s[s, 0] - x0
+        order = np.argsort(key, kind="stable")
+        key, s = key[order], s[order]
+        start = np.searchsorted(key, rows_q * span + boxes_q[q, 0] - x0, side)
+        n = np.searchsorted(key, rows_q * span + boxes_q[q, 2] - x0, "right") - start
+        n = np.maximum(n, 0)
+        return np.repeat(q, n), s[np.repeat(start, n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)], np.repeat(rows_q, n)
+
+    ar, ai = rows(a)
+    br, bi = rows(b)
+    # every overlapping pair has one interval starting inside the other; equal starts are found once
+    i1, j1, r1 = starting_in(ar, ai, a, br, bi, b, "left")
+    j2, i2, r2 = starting_in(br, bi, b, ar, ai, a, "right")
+    ia, ib, row = np.concatenate([i1, i2]), np.concatenate([j1, j2]), np.concatenate([r1, r2])
+    overlap = (a[ia, 0] <= b[ib, 2]) & (a[ia, 2] >= b[ib, 0]) & (a[ia, 1] <= b[ib, 3]) & (a[ia, 3] >= b[ib, 1])
+    ia, ib, row = ia[overlap], ib[overlap], row[overlap]
+    first = np.floor((np.maximum(a[ia, 1], b[ib, 1]) - y0) / height).astype(np.int64) == row
+    return ia[first], ib[first]
+
+def point_segment_distance(p, a, b):
+    ab, ap = b - a, p - a
+    t = np.clip(np.sum(ap * ab, axis=-1) / np.maximum(np.sum(ab * ab, axis=-1), 1e-300), 0, 1)
+    return np.linalg.norm(ap - t[..., None] * ab, axis=-1)
+
+def cross(o, a, b):
+    return (a[..., 0] - o[..., 0]) * (b[..., 1] - o[..., 1]) - (a[..., 1] - o[..., 1]) * (b[..., 0] - o[..., 0])
+
+def contains(P, points):
+    # even-odd test of points[i] against polygon P[i]
+    x, y = points[:, None, 0], points[:, None, 1]
+    x0, y0 = P[..., 0], P[..., 1]
+    x1, y1 = np.roll(x0, -1, axis=1), np.roll(y0, -1, axis=1)
+    dy = np.where(y1 != y0, y1 - y0, 1)
+    crossing = ((y0 > y) != (y1 > y)) & (x < (x1 - x0) * (y - y0) / dy + x0)
+    return crossing.sum(axis=1) % 2 == 1
+
+def segment_distances(a, b, c, d):
+    # distance between segments a-b and c-d, 0 where they cross
+    distance = np.minimum.reduce([point_segment_distance(a, c, d), point_segment_distance(b, c, d),
+                                  point_segment_distance(c, a, b), point_segment_distance(d, a, b)])
+    crossing = (cross(a, b, c) * cross(a, b, d) < 0) & (cross(c, d, a) * cross(c, d, b) < 0)
+    return np.where(crossing, 0, distance)
+
+def edges(P):
+    # the edges of the padded polygons P as (start, end, polygon), without the zero length ones
+    ends = np.roll(P, -1, axis=1)
+    keep = np.any(P != ends, axis=2)
+    return P[keep], ends[keep], np.nonzero(keep)[0]
+
+def edge_pieces(starts, ends, length):
+    # edges cut into pieces no longer than length, as (start, end, edge)
+    n = np.maximum(np.ceil(np.linalg.norm(ends - starts, axis=1) / length), 1).astype(np.int64)
+    edge = np.repeat(np.arange(len(starts)), n)
+    k = (np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n))[:, None]
+    step = ((ends - starts) / n[:, None])[edge]
+    return starts[edge] + k * step, starts[edge] + (k + 1) * step, edge
+
+def edge_pairs(a, b, spacing, length):
+    # index pairs of edges a-b that may come within spacing of each other. Edges of one direction
+    # are indexed in their own slab, rotated so they run along x and swept in rows; the parallel
+    # sides of neighbouring fan-out routes never meet there unless they are close. Edges of
+    # different directions meet on pieces no longer than the given length, in grid cells that size.
+    d = b - a
+    angle = np.round(np.degrees(np.arctan2(d[:, 1], d[:, 0])) % 180, 6) % 180
+    directions, group = np.unique(angle, return_inverse = True)
+    i, j = [], []
+    for g, direction in enumerate(np.radians(directions)):
+        e = np.flatnonzero(group == g)
+        rotation = np.array([[np.cos(direction), -np.sin(direction)], [np.sin(direction), np.cos(direction)]])
+        ra, rb = a[e] @ rotation, b[e] @ rotation
+        boxes = np.concatenate([np.minimum(ra, rb), np.maximum(ra, rb)], axis=1)
+        ei, ej = strip_pairs(boxes, boxes, spacing, max(spacing, 1e-3))
+        i.append(e[ei])
+        j.append(e[ej])
+
+    pa, pb, edge = edge_pieces(a, b, length)
+    boxes = np.concatenate([np.minimum(pa, pb), np.maximum(pa, pb)], axis=1)
+    order = np.argsort(group[edge], kind = "stable")
+    bounds = np.searchsorted(group[edge][order], np.arange(len(directions) + 1))
+    for g in range(len(directions) - 1):
+        x, y = order[bounds[g]:bounds[g + 1]], order[bounds[g + 1]:]
+        pi, pj = grid_pairs(boxes[x], boxes[y], spacing, max(length, spacing))
+        i.append(edge[x[pi]])
+        j.append(edge[y[pj]])
+    return np.concatenate(i), np.concatenate(j)
+
+def piece_length(a, b, spacing):
+    # the length edges are cut to and the height of the polygon slices: the geometric mean
+    # of the mean diagonal and the median edge, which keeps both the number of pieces and the
+    # geometry each piece's bounding box reaches into growing slower than the routes get longer
+    d = b - a
+    lengths = np.linalg.norm(d, axis=1)
+    diagonal = lengths[(d[:, 0] != 0) & (d[:, 1] != 0)]
+    return max(np.sqrt(diagonal.mean() * np.median(lengths)) if len(diagonal) else 0, np.median(lengths), spacing, 1e-3)
+
+def slices(P, height):
+    # bounding boxes of the parts of each polygon P[i] in horizontal bands of the given height, as
+    # (boxes, polygon); they cover a long diagonal route with a few small boxes rather than one
+    # holding every port and polygon that lies beside it
+    lo = np.floor(P[:, :, 1].min(axis=1) / height).astype(np.int64)
+    n = np.floor(P[:, :, 1].max(axis=1) / height).astype(np.int64) - lo + 1
+    owner = np.repeat(np.arange(len(P)), n)
+    y0 = ((lo[owner] + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)) * height)[:, None]
+    y1 = y0 + height
+    a, b = P[owner], np.roll(P[owner], -1, axis=1)
+    dy = b[..., 1] - a[..., 1]
+    flat = dy == 0
+    dy = np.where(flat, 1, dy)
+    # each edge clipped to the band
+    t0, t1 = (y0 - a[..., 1]) / dy, (y1 - a[..., 1]) / dy
+    t0, t1 = np.where(flat, 0, np.maximum(np.minimum(t0, t1), 0)), np.where(flat, 1, np.minimum(np.maximum(t0, t1), 1))
+    inside = np.where(flat, (a[..., 1] >= y0) & (a[..., 1] <= y1), t0 <= t1)
+    x0, x1 = a[..., 0] + t0 * (b[..., 0] - a[..., 0]), a[..., 0] + t1 * (b[..., 0] - a[..., 0])
+    boxes = np.stack([np.where(inside, np.minimum(x0, x1), np.inf).min(axis=1), np.maximum(y0[:, 0], P[owner, :, 1].min(axis=1)),
+                      np.where(inside, np.maximum(x0, x1), -np.inf).max(axis=1), np.minimum(y1[:, 0], P[owner, :, 1].max(axis=1))], axis=1)
+    return boxes, owner
+
+def slice_pairs(points, boxes, owner, distance):
+    # (i, j) for every point i within distance of a slice of polygon j, each pair once
+    pi, si = grid_pairs(np.concatenate([points, points], axis=1), boxes, distance)
+    n = owner.max() + 1 if len(owner) else 1
+    pairs = np.unique(pi * n + owner[si])
+    return pairs // n, pairs % n
+
+def polygon_pairs(P, a, b, owner, cover, spacing, length):
+    # (i, j, distance) for every pair of polygons closer than spacing, 0 where they touch or overlap,
+    # from their edges a-b and the slices cover of the padded polygons P
+    i, j = edge_pairs(a, b, spacing, length)
+    keep = owner[i] != owner[j]
+    i, j = i[keep], j[keep]
+    d = np.concatenate([segment_distances(a[i[s:s + 65536]], b[i[s:s + 65536]], a[j[s:s + 65536]], b[j[s:s + 65536]])
+                        for s in range(0, len(i), 65536)] or [np.zeros(0)])
+    i, j = np.where(owner[i] < owner[j], i, j), np.where(owner[i] < owner[j], j, i)
+    # a polygon lying entirely inside another crosses none of its edges
+    pi, qi = slice_pairs(P[:, 0], *cover, 0)
+    inside = (pi != qi) & contains(P[qi], P[pi, 0])
+    pi, qi = pi[inside], qi[inside]
+    first, second = np.concatenate([owner[i], np.minimum(pi, qi)]), np.concatenate([owner[j], np.maximum(pi, qi)])
+    pairs, inverse = np.unique(first * len(P) + second, return_inverse = True)
+    distance = np.full(len(pairs), np.inf)
+    np.minimum.at(distance, inverse, np.concatenate([d, np.zeros(len(pi))]))
+    return pairs // len(P), pairs % len(P), distance
+
+def point_distances(points, P):
+    # distance from points[i] to polygon P[i], 0 inside
+    d = point_segment_distance(points[:, None], P, np.roll(P, -1, axis=1)).min(axis=1)
+    return np.where(contains(P, points), 0, d)
+
+def min_widths(polygons):
+    # smallest distance between two facing, anti-parallel edges of each polygon
+    out = np.full(len(polygons), np.inf)
+    sizes = np.array([len(p) for p in polygons])
+    for k in np.unique(sizes):
+        index = np.flatnonzero(sizes == k)
+        P = np.array([polygons[i] for i in index], dtype=np.float64)
+        Pe = np.roll(P, -1, axis=1)
+        area = np.sum(P[:, :, 0] * Pe[:, :, 1] - Pe[:, :, 0] * P[:, :, 1], axis=1)
+        edge = Pe - P
+        length = np.maximum(np.linalg.norm(edge, axis=-1), 1e-300)
+        direction = edge / length[..., None]
+        inward = np.stack([-direction[..., 1], direction[..., 0]], axis=-1) * np.sign(area)[:, None, None]
+        anti = np.einsum("nid,njd->nij", direction, direction) < -0.9
+        facing = np.einsum("nijd,nid->nij", (P + Pe)[:, None] / 2 - P[:, :, None], inward) > 0
+        ta = np.einsum("nijd,nid->nij", P[:, None] - P[:, :, None], direction) / length[:, :, None]
+        tb = np.einsum("nijd,nid->nij", Pe[:, None] - P[:, :, None], direction) / length[:, :, None]
+        overlap = np.maximum(np.minimum(ta, tb), 0) < np.minimum(np.maximum(ta, tb), 1)
+        d = np.minimum.reduce([point_segment_distance(P[:, :, None], P[:, None], Pe[:, None]),
+                               point_segment_distance(Pe[:, :, None], P[:, None], Pe[:, None]),
+                               np.swapaxes(point_segment_distance(P[:, :, None], P[:, None], Pe[:, None]), 1, 2),
+                               np.swapaxes(point_segment_distance(Pe[:, :, None], P[:, None], Pe[:, None]), 1, 2)])
+        out[index] = np.where(anti & facing & overlap, d, np.inf).min(axis=(1, 2))
+    return out
+
+def components(n, i, j):
+    # connected components of n nodes joined by the edges (i, j), as the smallest node index
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[i], labels[j])
+        new = labels.copy()
+        np.minimum.at(new, i, low)
+        np.minimum.at(new, j, low)
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+def port_nets(array):
+    bar_ports, pad_ports = array.port_tables()
+    ports = port_table.concatenate(bar_ports + (pad_ports if isinstance(pad_ports, list) else [pad_ports]))
+    vertical = np.isin(ports.side, ["b", "t", "pb", "pt"])
+    index = ports.index.copy()
+    if array.pad_style == "single_line":
+        # one column of pads, the first num_bars[0] for the vertical bars
+        pads = ports.side == "pr"
+        vertical |= pads & (index < array.num_bars[0])
+        index[pads & ~vertical] -= array.num_bars[0]
+    return ports.midpoints, np.array([("v" if v else "h") + str(i) for v, i in zip(vertical, index)])
+
+def check_layer(layer, polygons, points, nets, spacing, width, label_distance, tol):
+    violations = []
+    bb, P = bboxes(polygons), padded(polygons)
+    a, b, owner = edges(P)
+    length = piece_length(a, b, spacing)
+    cover = slices(P, length)
+    i, j, d = polygon_pairs(P, a, b, owner, cover, spacing, length)
+    touching = d <= tol
+    component = components(len(polygons), i[touching], j[touching])
+
+    pi, qi = slice_pairs(points, *cover, label_distance)
+    attached = point_distances(points[pi], P[qi]) <= label_distance
+    component_nets = {}
+    for c, net in zip(component[qi[attached]], nets[pi[attached]]):
+        component_nets.setdefault(c, set()).add(str(net))
+    net_components = {}
+    for c, c_nets in component_nets.items():
+        for net in c_nets:
+            net_components.setdefault(net, []).append(c)
+
+    def location(rows):
+        box = bb[rows]
+        return (float(box[:, 0].min() + box[:, 2].max()) / 2, float(box[:, 1].min() + box[:, 3].max()) / 2)
+
+    for c, c_nets in component_nets.items():
+        if len(c_nets) > 1:
+            violations.append({"rule": "short", "layer": layer, "nets": sorted(c_nets), "location": location(np.flatnonzero(component == c))})
+    for net, c in net_components.items():
+        # pad openings are separate islands by design, only conductors can be open
+        if len(c) > 1 and layer in [1, 3]:
+            violations.append({"rule": "open", "layer": layer, "nets": [net], "location": location(np.flatnonzero(np.isin(component, c)))})
+
+    close = (d > tol) & (d < spacing - tol) & (component[i] != component[j])
+    worst = {}
+    for a, b, distance in zip(i[close], j[close], d[close]):
+        key = (tuple(sorted(component_nets.get(component[a], []))), tuple(sorted(component_nets.get(component[b], []))))
+        key = tuple(sorted(key))
+        if key not in worst or distance < worst[key][0]:
+            worst[key] = (distance, a, b)
+    for (nets_a, nets_b), (distance, a, b) in worst.items():
+        violations.append({"rule": "spacing", "layer": layer, "nets": list(nets_a) + list(nets_b), "distance": float(distance), "location": location([a, b])})
+
+    widths = min_widths(polygons)
+    for a in np.flatnonzero(widths < width - tol):
+        violations.append({"rule": "width", "layer": layer, "nets": sorted(component_nets.get(component[a], [])), "width": float(widths[a]), "location": location([a])})
+    return violations
+
+def rules(array, spacing = None, width = None):
+    # the default minimum spacing and width are those the array's own bars are drawn with
+    if spacing is None:
+        spacing = array.bar_pitch - array.bar_width
+        if array.pad_style == "interleaved":
+            spacing = min(spacing, array.interleaved_pad_spacing)
+    if width is None:
+        width = array.bar_width
+    return spacing, width
+
+def check(array, spacing = None, width = None, tol = 1e-3):
+    # checks the last build of array; spacing and width are numbers or {layer: number} dicts
+    spacing, width = rules(array, spacing, width)
+    bars, pads, routes = array.stage_output("bars"), array.stage_output("pads"), array.stage_output("routes")
+    layers = {}
+    for part in [bars[0], bars[1], pads[0], pads[1], routes[0], routes[1]]:
+        for (layer, _), polygons in part.get_polygons(by_spec = True).items():
+            layers.setdefault(layer, []).extend(polygons)
+
+    points, nets = port_nets(array)
+    vertical = np.char.startswith(nets, "v")
+    violations = []
+    for layer, polygons in sorted(layers.items()):
+        # vertical bars and their pads are on layers 1 and 4, horizontal ones on 3 and 5
+        on_layer = vertical if layer in [1, 4] else ~vertical
+        # the pad openings (layers 4 and 5) sit pad_dimensions[2] inside the pad edge the ports are on
+        label_distance = tol if layer in [1, 3] else array.pad_dimensions[2] + tol
+        layer_spacing = spacing.get(layer, 0) if isinstance(spacing, dict) else spacing
+        layer_width = width.get(layer, 0) if isinstance(width, dict) else width
+        # a zero length route segment extrudes to NaN vertices, which nothing can be measured against
+        finite = [np.isfinite(p).all() for p in polygons]
+        for p in [p for p, f in zip(polygons, finite) if not f]:
+            p = p[np.isfinite(p).all(axis=1)]
+            violations.append({"rule": "non_finite", "layer": layer, "nets": [],
+                               "location": tuple(((p.min(axis=0) + p.max(axis=0)) / 2).tolist()) if len(p) else None})
+        polygons = [p for p, f in zip(polygons, finite) if f]
+        if polygons:
+            violations += check_layer(layer, polygons, points[on_layer], nets[on_layer], layer_spacing, layer_width, label_distance, tol)
+    return violations
@@ -0,0 +1,85 @@
+from phidl import Device
+import numpy as np
+import io
+import gzip
+from collections import Counter
+
+# Deduplicates polygons that are copies of one another up to translation, 90 degree
+# rotation and mirroring. Each distinct shape is written once into its own cell and
+# every copy becomes a reference to it, so e.g. the mirror-image routes on opposite
+# sides of the array share a cell.
+
+# (x_reflection, rotation) in GDS order: mirror about the x axis first, then rotate
+TRANSFORMS = [(reflect, rotation) for reflect in [False, True] for rotation in [0, 90, 180, 270]]
+
+def _matrix(reflect, rotation):
+    c, s = {0: (1, 0), 90: (0, 1), 180: (-1, 0), 270: (0, -1)}[rotation]
+    return np.array([[c, -s], [s, c]]) @ np.diag([1, -1 if reflect else 1])
+
+def _inverse(reflect, rotation):
+    return (True, rotation) if reflect else (False, (360 - rotation) % 360)
+
+def _normalize(points, decimals):
+    # translates every (N, K, 2) polygon so its lowest-leftmost vertex sits at the
+    # origin and comes first
+    rounded = np.round(points, decimals) + 0.0
+    x, y = rounded[:, :, 0], rounded[:, :, 1]
+    first = np.argmin(np.where(x == x.min(axis=1, keepdims=True), y, np.inf), axis=1)
+    order = (np.arange(points.shape[1]) + first[:, None]) % points.shape[1]
+    shift = points[np.arange(len(points)), first]
+    normalized = np.take_along_axis(points - shift[:, None], order[:, :, None], axis=1)
+    keys = np.round(normalized, decimals) + 0.0
+    return normalized, shift, [k.tobytes() for k in keys]
+
+def canonical_shapes(polygons, decimals = 6):
+    # returns (key, shape, reflect, rotation, origin) per polygon, where placing
+    # `shape` with the given reference transform reproduces the polygon
+    out = [None] * len(polygons)
+    sizes = np.array([len(p) for p in polygons])
+    for size in np.unique(sizes):
+        index = np.flatnonzero(sizes == size)
+        points = np.array([polygons[i] for i in index], dtype=np.float64)
+        candidates = []
+        for reflect, rotation in TRANSFORMS:
+            matrix = _matrix(reflect, rotation)
+            for reverse in [False, True]:
+                transformed = points @ matrix.T
+                if reverse:
+                    transformed = transformed[:, ::-1]
+                normalized, shift, keys = _normalize(transformed, decimals)
+                origin = shift @ np.linalg.inv(matrix).T
+                candidates.append((keys, normalized, origin, _inverse(reflect, rotation)))
+        for j, i in enumerate(index):
+            keys, normalized, origin, (reflect, rotation) = min(candidates, key = lambda c: c[0][j])
+            out[i] = (keys[j], normalized[j], reflect, rotation, origin[j])
+    return out
+
+def hierarchical_device(polygons, layer, name = "routes", cell_name = "route", min_copies = 4):
+    # shapes with fewer than min_copies copies stay plain polygons, since a cell
+    # plus its references only beats repeating the polygon from about 4 copies up
+    shapes = canonical_shapes(polygons)
+    copies = Counter(shape[0] for shape in shapes)
+    D = Device(name)
+    cells = {}
+    for polygon, (key, shape, reflect, rotation, origin) in zip(polygons, shapes):
+        if copies[key] < min_copies:
+            D.add_polygon(polygon, layer = layer)
+            continue
+        if key not in cells:
+            cells[key] = Device(cell_name)
+            cells[key].add_polygon(shape, layer = layer)
+        ref = D.add_ref(cells[key])
+        ref.x_reflection = reflect
+        ref.rotation = rotation
+        ref.origin = tuple(origin)
+    return D
+
+def gds_size(device, cellname, compress = False, compresslevel = 6):
+    # bytes of device's GDS as save() writes it, without touching the disk
+    buffer = io.BytesIO()
+    if not compress:
+        device.write_gds(buffer, cellname = cellname)
+        return buffer.tell()
+    with gzip.GzipFile(fileobj = buffer, mode = "wb", compresslevel = compresslevel) as f:
+        device.write_gds(f, cellname = cellname)
+    return buffer.tell()
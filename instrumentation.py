@@ -0,0 +1,86 @@
+from phidl import Device
+from ports import port_table
+import cProfile
+import io
+import pstats
+import time
+
+# Opt-in per-stage instrumentation for diode_array.build. While a stage_profiler is
+# attached to an array (see diode_array.profile), every stage that gets rebuilt is
+# timed, the cells, polygons, references and port table rows it produced are
+# counted, and selected stages can be run under cProfile. With no profiler
+# attached, diode_array.stage skips all of this.
+
+# the diode_array method each stage is drawn by
+METHODS = {"bars": "draw_bars", "circles": "draw_circles", "pads": "draw_pads_{}", "labels": "draw_labels_{}",
+           "routes": "route_pads_{}", "inversion": "invert"}
+
+def stage_devices(output):
+    # stages return a Device, or a tuple whose leading entries are Devices
+    if isinstance(output, Device):
+        return [output]
+    return [o for o in output if isinstance(o, Device)]
+
+def count_ports(output):
+    # ports are returned as port tables, either alone or in a list of tables
+    items = list(output) if isinstance(output, tuple) else [output]
+    tables = [t for item in items for t in (item if isinstance(item, list) else [item])]
+    return sum(len(t) for t in tables if isinstance(t, port_table))
+
+def count_elements(devices):
+    cells = set(devices)
+    for device in devices:
+        cells.update(device.get_dependencies(recursive = True))
+    return {"cells": len(cells),
+            "polygons": sum(len(p.polygons) for c in cells for p in c.polygons),
+            "references": sum(len(c.references) for c in cells)}
+
+class stage_profiler:
+    def __init__(self, cprofile = False, callback = None):
+        # cprofile is True for every stage or a list of stage names
+        self.cprofile = cprofile
+        self.callback = callback
+        self.records = []
+        self.start = time.perf_counter()
+        self.total_time = None
+
+    def profiled(self, name):
+        return self.cprofile is True or (bool(self.cprofile) and name in self.cprofile)
+
+    def run(self, name, pad_style, build, *args):
+        profile = cProfile.Profile() if self.profiled(name) else None
+        start = time.perf_counter()
+        if profile is None:
+            output = build(*args)
+        else:
+            output = profile.runcall(build, *args)
+        record = {"stage": name, "method": METHODS[name].format(pad_style), "time": time.perf_counter() - start}
+        record.update(count_elements(stage_devices(output)), ports = count_ports(output))
+        if profile is not None:
+            record["profile"] = pstats.Stats(profile)
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+        return output
+
+    def stop(self):
+        self.total_time = time.perf_counter() - self.start
+
+    def report(self):
+        return {"total_time": self.total_time, "stages": [{k: v for k, v in r.items() if k != "profile"} for r in self.records]}
+
+    def print_profile(self, name, sort = "cumulative", limit = 20):
+        out = io.StringIO()
+        for record in self.records:
+            if record["stage"] == name and "profile" in record:
+                record["profile"].stream = out
+                record["profile"].sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def __str__(self):
+        lines = [f"{'stage':<10} {'method':<24} {'time [s]':>9} {'cells':>6} {'polygons':>9} {'refs':>6} {'ports':>6}"]
+        for r in self.records:
+            lines.append(f"{r['stage']:<10} {r['method']:<24} {r['time']:9.4f} {r['cells']:6d} {r['polygons']:9d} {r['references']:6d} {r['ports']:6d}")
+        if self.total_time is not None:
+            lines.append(f"{'total':<35} {self.total_time:9.4f}")
+        return "\n".join(lines)
@@ -0,0 +1,142 @@
+from phidl import Device
+from phidl.device_layout import CellArray
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import gdspy
+import numpy as np
+
+# Tiled replacement for pg.boolean(bbox, be, "A-B"). The bounding box is cut into
+# tiles and each tile only clips against the polygons whose bounding boxes touch it,
+# which keeps every clipper call small. Tiles are independent, so they can be
+# handed to a process pool.
+#
+# The back end is never flattened as a whole. geometry() turns a Device into parts:
+# arrays of a leaf cell (the bars, pads and extenders) stay one cell plus an
+# instance grid, and only the remaining polygons (the routes) are kept, as NumPy
+# arrays with their bounding boxes. A tile asks every part for the polygons that
+# touch it, so back end polygons exist for one tile at a time (two per worker with
+# a process pool).
+
+def _bounds(polygons):
+    return np.array([np.concatenate([p.min(axis=0), p.max(axis=0)]) for p in polygons]).reshape(-1, 4)
+
+def _touching(bboxes, tile):
+    return (bboxes[:, 0] <= tile[2]) & (bboxes[:, 2] >= tile[0]) & (bboxes[:, 1] <= tile[3]) & (bboxes[:, 3] >= tile[1])
+
+class polygon_part:
+    def __init__(self, polygons):
+        self.polygons = [np.asarray(p, dtype=np.float64) for p in polygons]
+        self.bboxes = _bounds(self.polygons)
+
+    def touching(self, tile):
+        return [self.polygons[i] for i in np.flatnonzero(_touching(self.bboxes, tile))]
+
+class array_part:
+    # the polygons of an unrotated array of a leaf cell, generated for the instances a tile touches
+    def __init__(self, polygons, origin, columns, rows, spacing):
+        self.polygons = [np.asarray(p, dtype=np.float64) for p in polygons]
+        bboxes = _bounds(self.polygons)
+        self.bbox = np.concatenate([bboxes[:, :2].min(axis=0), bboxes[:, 2:].max(axis=0)]) if len(bboxes) else np.zeros(4)
+        self.x = origin[0] + np.arange(int(columns)) * spacing[0]
+        self.y = origin[1] + np.arange(int(rows)) * spacing[1]
+
+    def touching(self, tile):
+        if not self.polygons:
+            return []
+        x = self.x[(self.x + self.bbox[0] <= tile[2]) & (self.x + self.bbox[2] >= tile[0])]
+        y = self.y[(self.y + self.bbox[1] <= tile[3]) & (self.y + self.bbox[3] >= tile[1])]
+        shifted = [p + (dx, dy) for dx in x for dy in y for p in self.polygons]
+        return [p for p in shifted if _touching(_bounds([p]), tile)[0]]
+
+def _plain(reference):
+    return not reference.rotation and not reference.x_reflection and reference.magnification in (None, 1)
+
+def geometry(device, offset = (0, 0)):
+    # the parts of device, translated by offset; untransformed references are followed down
+    # to arrays of leaf cells, everything else ends up in one polygon_part per cell
+    offset = np.asarray(offset, dtype=np.float64)
+    parts, flat = [], [p + offset for polygon_set in device.polygons for p in polygon_set.polygons]
+    for reference in device.references:
+        if not _plain(reference):
+            flat += [p + offset for p in reference.get_polygons()]
+        elif isinstance(reference, CellArray):
+            if reference.parent.references:
+                flat += [p + offset for p in reference.get_polygons()]
+            else:
+                parts.append(array_part(reference.parent.get_polygons(), offset + reference.origin,
+                                        reference.columns, reference.rows, reference.spacing))
+        elif reference.parent.references:
+            parts += geometry(reference.parent, offset + reference.origin)
+        else:
+            flat += [p + offset for p in reference.get_polygons()]
+    if flat:
+        parts.append(polygon_part(flat))
+    return parts
+
+def bounding_box(device):
+    # device.bbox, or None for an empty device, without gdspy's bounding box per array instance
+    boxes = [polygon_set.get_bounding_box() for polygon_set in device.polygons]
+    for reference in device.references:
+        if not _plain(reference):
+            boxes.append(reference.get_bounding_box())
+            continue
+        cell = bounding_box(reference.parent)
+        if cell is None:
+            continue
+        lo, hi = cell + np.asarray(reference.origin, dtype=np.float64)
+        if isinstance(reference, CellArray):
+            span = np.array([(int(reference.columns) - 1) * reference.spacing[0], (int(reference.rows) - 1) * reference.spacing[1]])
+            lo, hi = lo + np.minimum(span, 0), hi + np.maximum(span, 0)
+        boxes.append(np.array([lo, hi]))
+    boxes = [b for b in boxes if b is not None]
+    if not boxes:
+        return None
+    boxes = np.array(boxes)
+    return np.array([boxes[:, 0].min(axis=0), boxes[:, 1].max(axis=0)])
+
+def _invert_tile(args):
+    tile, polygons, precision, max_points = args
+    rect = gdspy.Rectangle(tile[:2], tile[2:])
+    if len(polygons) == 0:
+        return [rect.polygons[0]]
+    result = gdspy.boolean(rect, polygons, "not", precision=precision, max_points=max_points)
+    return [] if result is None else result.polygons
+
+def tile_bounds(bounds, num_tiles, precision = 1e-4):
+    # tile edges sit on the precision grid that the clipper snaps to, so empty tiles (which
+    # skip the clipper) and clipped tiles meet on the same seams, as in pg.boolean's output
+    (xmin, ymin), (xmax, ymax) = bounds
+    xs = np.round(np.linspace(xmin, xmax, num_tiles[0] + 1) / precision) * precision
+    ys = np.round(np.linspace(ymin, ymax, num_tiles[1] + 1) / precision) * precision
+    return [(xs[i], ys[j], xs[i + 1], ys[j + 1]) for i in range(num_tiles[0]) for j in range(num_tiles[1])]
+
+def invert_tiles(bounds, parts, num_tiles = (8, 8), workers = 1, precision = 1e-4, max_points = 4000):
+    # yields the inverted polygons of one tile at a time; parts is a Device or the parts of one
+    if isinstance(parts, Device):
+        parts = geometry(parts)
+    jobs = ((tile, [p for part in parts for p in part.touching(tile)], precision, max_points) for tile in tile_bounds(bounds, num_tiles, precision))
+    if workers > 1:
+        # a few tiles per worker in flight, in tile order
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            pending = deque()
+            for job in jobs:
+                pending.append(executor.submit(_invert_tile, job))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    else:
+        for job in jobs:
+            yield _invert_tile(job)
+
+def add_fractured(device, polygons, layer, precision = 1e-4, max_points = 4000):
+    if len(polygons) > 0:
+        for polygon in device.add_polygon(polygons, layer = layer):
+            polygon.fracture(max_points = max_points, precision = precision)
+    return device
+
+def invert_tiled(bounds, parts, num_tiles = (8, 8), workers = 1, precision = 1e-4, max_points = 4000, layer = 0):
+    D = Device("invert")
+    for tile_polygons in invert_tiles(bounds, parts, num_tiles, workers, precision, max_points):
+        add_fractured(D, tile_polygons, layer, precision, max_points)
+    return D
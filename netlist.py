@@ -0,0 +1,129 @@
+import numpy as np
+import csv
+
+# Columnar net tables of a diode_array. Every route is recorded by route_batch
+# from the waypoints it extrudes, so the segment lengths, widths and square counts
+# come out of the routing pass itself; the bars and the crosspoint map are filled in
+# from the bar port tables. Nets are named as in drc.py: "v3" is vertical bar 3 with
+# its route and pad, "h3" horizontal bar 3. Resistances are sheet resistance times
+# squares, with a linear width taper integrated exactly.
+
+def squares(lengths, width_start, width_end):
+    # length / width of segments whose width changes linearly from width_start to width_end
+    taper = ~np.isclose(width_start, width_end)
+    ratio = np.log(np.where(taper, width_end / width_start, 1)) / np.where(taper, width_end - width_start, 1)
+    return np.where(taper, lengths * ratio, lengths / width_start)
+
+def route_record(pad, bar, layer, paths, w1, w2):
+    # the routes of one group of (N, K, 2) waypoints: per route columns and (N, K - 1) segment lengths and widths
+    lengths = np.linalg.norm(np.diff(paths, axis=1), axis=-1)
+    total = lengths.sum(axis=1)
+    end = np.cumsum(lengths, axis=1)
+    fraction = lambda l: l / np.where(total > 0, total, 1)[:, None]
+    width_start = w1[:, None] + fraction(end - lengths) * (w2 - w1)[:, None]
+    width_end = w1[:, None] + fraction(end) * (w2 - w1)[:, None]
+    return {"net": np.array([("v" if layer == 1 else "h") + str(i) for i in bar.index]), "bar": bar.index, "pad": np.array(pad.names()),
+            "layer": np.full(len(bar), layer), "lengths": lengths, "width_start": width_start, "width_end": width_end}
+
+class netlist:
+    def __init__(self, nets, segments, crosspoints = None):
+        # dicts of equally long columns; segments[route] is the row of their route in nets
+        self.nets = nets
+        self.segments = segments
+        self.crosspoints = crosspoints
+
+    @classmethod
+    def from_records(cls, records):
+        # one net per route, ordered vertical bars first, by bar index
+        if not records:
+            empty = np.zeros(0)
+            return cls({"net": np.zeros(0, dtype=str), "bar": empty.astype(np.int64), "pad": np.zeros(0, dtype=str), "layer": empty.astype(np.int64),
+                        "route_length": empty, "route_squares": empty, "route_segments": empty.astype(np.int64)},
+                       {"route": empty.astype(np.int64), "segment": empty.astype(np.int64), "length": empty, "width_start": empty, "width_end": empty, "squares": empty})
+        net = np.concatenate([r["net"] for r in records])
+        layer = np.concatenate([r["layer"] for r in records])
+        bar = np.concatenate([r["bar"] for r in records])
+        order = np.lexsort((bar, layer))
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+
+        route, segment, lengths, width_start, width_end = [], [], [], [], []
+        start = 0
+        for r in records:
+            n, k = r["lengths"].shape
+            route.append(np.repeat(rank[start:start + n], k))
+            segment.append(np.tile(np.arange(k), n))
+            lengths.append(r["lengths"].ravel())
+            width_start.append(r["width_start"].ravel())
+            width_end.append(r["width_end"].ravel())
+            start += n
+        segments = {"route": np.concatenate(route), "segment": np.concatenate(segment), "length": np.concatenate(lengths),
+                    "width_start": np.concatenate(width_start), "width_end": np.concatenate(width_end)}
+        segments["squares"] = squares(segments["length"], segments["width_start"], segments["width_end"])
+        by_route = np.lexsort((segments["segment"], segments["route"]))
+        segments = {k: v[by_route] for k, v in segments.items()}
+
+        nets = {"net": net[order], "bar": bar[order], "pad": np.concatenate([r["pad"] for r in records])[order], "layer": layer[order],
+                "route_length": np.bincount(segments["route"], segments["length"], len(order)),
+                "route_squares": np.bincount(segments["route"], segments["squares"], len(order)),
+                "route_segments": np.bincount(segments["route"], minlength=len(order))}
+        return cls(nets, segments)
+
+    def with_bars(self, bar_ports, bar_width, bar_lengths, circle_radius):
+        # adds the bar columns and the crosspoint map; bar_ports are the b, t, l, r tables of draw_bars
+        nets = dict(self.nets)
+        vertical = nets["layer"] == 1
+        nets["bar_length"] = np.where(vertical, bar_lengths[1], bar_lengths[0]).astype(np.float64)
+        nets["bar_squares"] = nets["bar_length"] / bar_width
+        # the crosspoint vias of draw_circles sit on every bar intersection
+        x, y = bar_ports[0].midpoints[:, 0], bar_ports[2].midpoints[:, 1]
+        v, h = np.meshgrid(bar_ports[0].index, bar_ports[2].index, indexing="ij")
+        crosspoints = {"v": v.ravel(), "h": h.ravel(), "x": np.repeat(x, len(y)), "y": np.tile(y, len(x)),
+                       "radius": np.full(v.size, float(circle_radius))}
+        return netlist(nets, self.segments, crosspoints)
+
+    def with_resistance(self, sheet_resistance):
+        # sheet_resistance is a number or {layer: ohms per square}
+        nets, segments = dict(self.nets), dict(self.segments)
+        rs = lambda layer: np.array([sheet_resistance[l] if isinstance(sheet_resistance, dict) else sheet_resistance for l in layer], dtype=np.float64)
+        nets["route_resistance"] = rs(nets["layer"]) * nets["route_squares"]
+        if "bar_squares" in nets:
+            nets["bar_resistance"] = rs(nets["layer"]) * nets["bar_squares"]
+        segments["resistance"] = rs(nets["layer"][segments["route"]]) * segments["squares"]
+        return netlist(nets, segments, self.crosspoints)
+
+    def tables(self):
+        return {name: table for name, table in [("nets", self.nets), ("segments", self.segments), ("crosspoints", self.crosspoints)] if table is not None}
+
+    def save(self, prefix, format = "npz"):
+        # <prefix>_netlist.npz, or one CSV per table
+        if format == "npz":
+            return [self.save_npz(prefix + "_netlist.npz")]
+        if format == "csv":
+            return self.save_csv(prefix)
+        raise ValueError("Invalid netlist format")
+
+    def save_npz(self, path):
+        np.savez_compressed(path, **{f"{name}/{k}": v for name, table in self.tables().items() for k, v in table.items()})
+        return path
+
+    @classmethod
+    def load_npz(cls, path):
+        tables = {}
+        with np.load(path) as data:
+            for key in data.files:
+                name, column = key.split("/", 1)
+                tables.setdefault(name, {})[column] = data[key]
+        return cls(tables["nets"], tables["segments"], tables.get("crosspoints"))
+
+    def save_csv(self, prefix):
+        # one <prefix>_<table>.csv per table
+        paths = []
+        for name, table in self.tables().items():
+            path = f"{prefix}_{name}.csv"
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(list(table))
+                writer.writerows(zip(*[v.tolist() for v in table.values()]))
+            paths.append(path)
+        return paths
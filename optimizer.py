@@ -0,0 +1,195 @@
+from diode_array import diode_array
+from preflight import preflight, bar_ports
+from drc import rules
+from params import to_jsonable, from_jsonable
+from collections import Counter
+import numpy as np
+import argparse
+import json
+import sys
+
+# Picks pad_pitch, route_thetas, bar_pad_spacing and (for single pads)
+# single_pad_offsets with the analytic model in preflight.py instead of drawing.
+# For every pad_pitch and route_theta on a grid, the smallest bar_pad_spacing that
+# passes preflight is found by bisection, separately for the vertical and the
+# horizontal bars, whose checks do not depend on each other. The combination with
+# the smallest bounding box area (plus weight times the total or longest route) wins.
+# single_line routes its vertical bars manhattan style to the pads on the right, and
+# those routes depend on neither route_thetas nor bar_pad_spacing, only on
+# pad_pitch; if they collide at every pitch, the error names the blocking rules.
+
+def direction(error, pad_style):
+    # the bar_pad_spacing entry an error depends on; single_line routes every bar to the right
+    if pad_style == "single_line":
+        return [1]
+    if error.get("layer") == 1:
+        return [0]
+    if error.get("layer") == 3:
+        return [1]
+    return [0, 1]
+
+def failing(errors, pad_style):
+    out = np.zeros(2, dtype=bool)
+    for error in errors:
+        out[direction(error, pad_style)] = True
+    return out
+
+def centred_offsets(params):
+    # single pad rows centred on the bars they are routed to: even bars bottom/left, odd bars top/right
+    bars = bar_ports(diode_array(params))
+    return [float(bars[0].midpoints[0::2, 0].mean()), float(bars[1].midpoints[1::2, 0].mean()) if params["num_bars"][0] > 1 else 0.0,
+            float(bars[2].midpoints[0::2, 1].mean()), float(bars[3].midpoints[1::2, 1].mean()) if params["num_bars"][1] > 1 else 0.0]
+
+def lo_spacing(params):
+    # the pads cannot come closer than their own route stub
+    return params["pad_dimensions"][2] + params["pad_route_dist"]
+
+def spacing_search(params, build_kwargs, spacing, width, resolution, max_steps = 16):
+    # smallest bar_pad_spacing, per direction, at which that direction passes preflight (nan if none
+    # is found), and the errors that kept the nan directions from passing; assumes that moving the
+    # pads further out never makes a direction fail
+    def check(s):
+        report = preflight(dict(params, bar_pad_spacing = np.array(s)), spacing, width, **build_kwargs)
+        return failing(report["errors"], params["pad_style"]), report
+
+    lo = np.full(2, lo_spacing(params), dtype=np.float64)
+    failed, report = check(lo)
+    hi = np.where(failed, np.nan, lo)
+    # below the offset bound the routes double back, so the search starts there
+    bound = np.array([np.nan if b is None else b for b in report["feasible"]["bar_pad_spacing"]])
+    s = np.where(np.isnan(bound), lo, np.maximum(lo, bound))
+    step = params["bar_width"] + spacing
+    errors = report["errors"]
+    for _ in range(max_steps):
+        todo = np.isnan(hi)
+        if not todo.any():
+            break
+        failed, report = check(np.where(todo, s, hi))
+        errors = report["errors"]
+        hi[todo & ~failed] = s[todo & ~failed]
+        lo[todo & failed] = s[todo & failed]
+        s = np.where(todo & failed, s + step, s)
+        step *= 2
+    pad_style = params["pad_style"]
+    blocking = [e for e in errors if np.isnan(hi[direction(e, pad_style)]).any()]
+    while np.any(hi - lo > resolution):
+        active = hi - lo > resolution
+        mid = np.where(active, (lo + hi) / 2, hi)
+        failed, _ = check(mid)
+        hi = np.where(active & ~failed, mid, hi)
+        lo = np.where(active & failed, mid, lo)
+    return hi, blocking
+
+def blocking_rules(counts, n = 3):
+    # "rule on layer L (count)" for the most common preflight errors
+    return ", ".join(f"{rule}" + ("" if layer is None else f" on layer {layer}") + f" ({count})" for (rule, layer), count in counts.most_common(n))
+
+def direction_lengths(report, pad_style):
+    # (total, longest) route length of the vertical and the horizontal bars
+    total, longest = np.zeros(2), np.zeros(2)
+    for batch in report["batches"]:
+        d = 1 if pad_style == "single_line" or batch["layer"] == 3 else 0
+        total[d] += batch["route_length"]
+        longest[d] = max(longest[d], batch["max_route_length"])
+    return total, longest
+
+def cost(report, objective, weight):
+    (x0, y0), (x1, y1) = report["bbox"]
+    lengths = [b["route_length"] for b in report["batches"]] if objective == "total" else [b["max_route_length"] for b in report["batches"]]
+    length = sum(lengths) if objective == "total" else max(lengths)
+    return (x1 - x0) * (y1 - y0) + weight * length, (x1 - x0) * (y1 - y0), length
+
+def optimize(params, objective = "total", weight = 0.0, pad_pitches = None, route_thetas = None, resolution = 1.0, spacing = None, width = None):
+    # returns {"params", "build_kwargs", "area", "route_length", "report"}; objective is "total" or "max"
+    # route length, weight is in area units per unit of length and ties are broken on route length
+    if objective not in ["total", "max"]:
+        raise ValueError("Invalid objective")
+    params = dict(params)
+    style = params["pad_style"]
+    spacing, width = rules(diode_array(params), spacing, width)
+    d0, _, d2 = params["pad_dimensions"]
+    if pad_pitches is None:
+        # pads any closer than spacing fail anyway
+        pitch = d0 + 2 * d2 + spacing
+        pad_pitches = np.linspace(pitch, 2 * pitch, 6)
+    if route_thetas is None:
+        route_thetas = np.radians(np.arange(20, 81, 5))
+
+    best = None
+    # (rule, layer) counts of the preflight errors that ruled candidates out
+    blocking = Counter()
+    for pitch in pad_pitches:
+        # per direction (theta, bar_pad_spacing, route length) of every theta that has a feasible spacing
+        candidates = [[], []]
+        for theta in route_thetas:
+            p = dict(params, pad_pitch = pitch, route_thetas = [theta, theta])
+            build_kwargs = {"single_pad_offsets": centred_offsets(p)} if style == "single" else {}
+            s, errors = spacing_search(p, build_kwargs, spacing, width, resolution)
+            blocking.update((e["rule"], e.get("layer")) for e in errors)
+            if np.isnan(s).all():
+                continue
+            report = preflight(dict(p, bar_pad_spacing = np.nan_to_num(s, nan = lo_spacing(p))), spacing, width, **build_kwargs)
+            total, longest = direction_lengths(report, style)
+            length = total if objective == "total" else longest
+            for d in [0, 1]:
+                if not np.isnan(s[d]):
+                    candidates[d].append((theta, s[d], length[d]))
+        if style == "single_line":
+            # no pads above or below the bars, the vertical entries stay as they were
+            candidates[0] = [(params["route_thetas"][0], params["bar_pad_spacing"][0], 0.0)]
+        if not candidates[0] or not candidates[1]:
+            continue
+        # a smaller spacing never grows the area, so only the spacing / route length trade-offs are combined
+        fronts = [pareto(c) for c in candidates]
+        for theta0, s0, _ in fronts[0]:
+            for theta1, s1, _ in fronts[1]:
+                p = dict(params, pad_pitch = pitch, route_thetas = [theta0, theta1], bar_pad_spacing = np.array([s0, s1]))
+                build_kwargs = {"single_pad_offsets": centred_offsets(p)} if style == "single" else {}
+                report = preflight(p, spacing, width, **build_kwargs)
+                if not report["ok"]:
+                    blocking.update((e["rule"], e.get("layer")) for e in report["errors"])
+                    continue
+                value = cost(report, objective, weight)
+                if best is None or (value[0], value[2]) < (best[0][0], best[0][2]):
+                    best = (value, p, build_kwargs, report)
+    if best is None:
+        raise ValueError("No feasible layout found for the given pad_pitches and route_thetas"
+                         + (f"; blocked by {blocking_rules(blocking)}" if blocking else ""))
+    (_, area, length), p, build_kwargs, report = best
+    return {"params": p, "build_kwargs": build_kwargs, "area": area, "route_length": length, "report": report}
+
+def pareto(candidates):
+    # the candidates no other candidate beats on both spacing and route length
+    return [c for c in candidates if not any(o[1] <= c[1] and o[2] <= c[2] and (o[1], o[2]) != (c[1], c[2]) for o in candidates)]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Choose pad_pitch, route_thetas and bar_pad_spacing for the smallest diode_array.",
+                                     epilog="single_line arrays only optimize the horizontal routes; their vertical routes depend on pad_pitch alone.")
+    parser.add_argument("params", help="JSON file with the params dict to start from")
+    parser.add_argument("-o", "--output", default=None, help="JSON file to write the optimized params to")
+    parser.add_argument("--objective", choices=["total", "max"], default="total", help="route length to minimize")
+    parser.add_argument("--weight", type=float, default=0.0, help="area units per unit of route length")
+    parser.add_argument("--resolution", type=float, default=1.0, help="bar_pad_spacing resolution")
+    args = parser.parse_args(argv)
+
+    with open(args.params) as f:
+        params = from_jsonable(json.load(f))
+    try:
+        result = optimize(params, objective=args.objective, weight=args.weight, resolution=args.resolution)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    text = json.dumps(to_jsonable(result["params"]), indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(f"area {result['area']:.0f}, route length {result['route_length']:.0f}", file=sys.stderr)
+    if result["build_kwargs"]:
+        # single_pad_offsets is a build option, not a param
+        print(f"build with {to_jsonable(result['build_kwargs'])}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
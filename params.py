@@ -0,0 +1,31 @@
+import numpy as np
+
+# Conversions of params dicts (and build options) to and from plain JSON values.
+# to_jsonable / from_jsonable round-trip a dict through a JSON file, e.g. a sweep
+# manifest, a layout sidecar or a CLI input; normalize maps every dict that
+# describes the same layout to one value, for hashing.
+
+def jsonable(value):
+    if isinstance(value, (np.ndarray, list, tuple)):
+        return np.asarray(value).tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def to_jsonable(params):
+    return {k: jsonable(v) for k, v in params.items()}
+
+def from_jsonable(params):
+    # lists come back as arrays so that e.g. `num_bars - 1` works as in the notebook dicts
+    return {k: np.array(v) if isinstance(v, list) else v for k, v in params.items()}
+
+def normalize(value):
+    if isinstance(value, dict):
+        return {str(k): normalize(value[k]) for k in sorted(value)}
+    if isinstance(value, (str, bool, np.bool_)) or value is None:
+        return value.item() if isinstance(value, np.bool_) else value
+    array = np.asarray(value)
+    if array.dtype.kind in "iuf":
+        # 16, 16.0 and np.int64(16) all describe the same layout
+        return array.astype(np.float64).tolist()
+    return [normalize(v) for v in value]
@@ -0,0 +1,43 @@
+import numpy as np
+
+# Columnar stand-in for the lists of phidl Ports that the draw_* stages used to
+# create, one per bar end and pad. Each row is a port; name is side + index, as in
+# the old f"b{i}"/f"pl{i}" port names. The routers read the columns directly and
+# real Ports are only made by add_to(), e.g. for show_ports previews.
+
+class port_table:
+    def __init__(self, midpoints, widths, orientations, side, index):
+        self.midpoints = np.asarray(midpoints, dtype=np.float64).reshape(-1, 2)
+        n = len(self.midpoints)
+        self.widths = np.broadcast_to(np.asarray(widths, dtype=np.float64), (n,)).copy()
+        self.orientations = np.broadcast_to(np.asarray(orientations, dtype=np.float64), (n,)).copy()
+        self.side = np.broadcast_to(np.asarray(side), (n,)).copy()
+        self.index = np.broadcast_to(np.asarray(index, dtype=np.int64), (n,)).copy()
+
+    @classmethod
+    def concatenate(cls, tables):
+        return cls(np.concatenate([t.midpoints for t in tables]), np.concatenate([t.widths for t in tables]),
+                   np.concatenate([t.orientations for t in tables]), np.concatenate([t.side for t in tables]),
+                   np.concatenate([t.index for t in tables]))
+
+    def __len__(self):
+        return len(self.midpoints)
+
+    def __getitem__(self, rows):
+        return port_table(self.midpoints[rows], self.widths[rows], self.orientations[rows], self.side[rows], self.index[rows])
+
+    def arrays(self):
+        # (midpoints, orientations, widths), the per-row inputs of batch_routing.route_polygons
+        return self.midpoints, self.orientations, self.widths
+
+    def names(self):
+        return [f"{side}{i}" for side, i in zip(self.side, self.index)]
+
+    def add_to(self, device):
+        for name, midpoint, width, orientation in zip(self.names(), self.midpoints, self.widths, self.orientations):
+            if name not in device.ports:
+                device.add_port(name=name, midpoint=midpoint, width=width, orientation=orientation)
+
+def points(x, y):
+    # (N, 2) midpoints from x and y columns, either of which may be a scalar
+    return np.column_stack(np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)))
@@ -0,0 +1,221 @@
+from diode_array import diode_array
+from batch_routing import path_z, path_manhattan, extrude
+from ports import port_table, points
+from drc import segment_distances, min_widths, rules
+import numpy as np
+
+# Pre-flight check of a params dict, without drawing anything. The bar and pad
+# ports are computed in closed form from the same expressions draw_bars and
+# draw_pads_* evaluate on the placed arrays, and the route polygons with the same
+# route_offsets / path_z / path_manhattan / extrude calls route_pads_* makes, so
+# every route offset, the gaps between each route and its neighbouring routes, pads
+# and bars, and the bounding box of the bars, pads and routes are known in
+# milliseconds. Labels and circles are left out; drc.check covers the drawn layout.
+
+def bar_ports(array):
+    (L0, L1), w, pitch = array.bar_lengths, array.bar_width, array.bar_pitch
+    i = np.arange(array.num_bars[0])
+    x = -L0/2 + w/2 + i * pitch
+    b, t = port_table(points(x, -L1/2), w, -90, "b", i), port_table(points(x, L1/2), w, 90, "t", i)
+    i = np.arange(array.num_bars[1])
+    y = -L1/2 + w/2 + i * pitch
+    l, r = port_table(points(-L0/2, y), w, 180, "l", i), port_table(points(L0/2, y), w, 0, "r", i)
+    return [b, t, l, r]
+
+def pad_ports(array):
+    (L0, L1), (s0, s1), w = array.bar_lengths, array.bar_pad_spacing, array.bar_width
+    (_, d1, d2), pitch, (nx, ny) = array.pad_dimensions, array.pad_pitch, array.num_bars
+    # pads are d1 + 2 * d2 deep, their ports sit on the edge facing the bars, d2 inside bar_pad_spacing
+    y, x = L1/2 + s0 - d2, L0/2 + s1 - d2
+    if array.pad_style == "double":
+        i, j = np.arange(nx), np.arange(ny)
+        u, v = (i - (nx - 1)/2) * pitch, (j - (ny - 1)/2) * pitch
+        return [port_table(points(u, -y), w, 90, "pb", i), port_table(points(u, y), w, -90, "pt", i),
+                port_table(points(-x, v), w, 0, "pl", j), port_table(points(x, v), w, 180, "pr", j)]
+    if array.pad_style == "single":
+        # every row of pads is centred on its single_pad_offsets entry
+        offsets = array.single_pad_offsets
+        def row(start, n, count, offset):
+            i = np.arange(start, n, 2)
+            return i, offset + ((i - start)/2 - (count - 1)/2) * pitch
+        (ib, ub), (it, ut) = row(0, nx, np.ceil(nx/2), offsets[0]), row(1, nx, np.floor(nx/2), offsets[1])
+        (jl, vl), (jr, vr) = row(0, ny, np.ceil(ny/2), offsets[2]), row(1, ny, np.floor(ny/2), offsets[3])
+        return [port_table(points(ub, -y), w, 90, "pb", ib), port_table(points(ut, y), w, -90, "pt", it),
+                port_table(points(-x, vl), w, 0, "pl", jl), port_table(points(x, vr), w, 180, "pr", jr)]
+    if array.pad_style == "interleaved":
+        # even bars on the inner row, odd bars interleaved_pad_spacing further out; on top and right the rows swap
+        outer = d1 + 2 * d2 + array.interleaved_pad_spacing
+        i, j = np.arange(nx), np.arange(ny)
+        u = -pitch/4 - (np.ceil(nx/2) - 1) * pitch/2 + i * pitch/2
+        v = -pitch/4 - (np.ceil(ny/2) - 1) * pitch/2 + j * pitch/2
+        yb, xl = np.where(i % 2 == 0, y, y + outer), np.where(j % 2 == 0, x, x + outer)
+        yt, xr = np.where(i % 2 == 0, y + outer, y), np.where(j % 2 == 0, x + outer, x)
+        return [port_table(points(u, -yb), w, 90, "pb", i), port_table(points(u, yt), w, -90, "pt", i),
+                port_table(points(-xl, v), w, 0, "pl", j), port_table(points(xr, v), w, 180, "pr", j)]
+    if array.pad_style == "single_line":
+        i = np.arange(nx + ny)
+        return port_table(points(x, (i - (nx + ny - 1)/2) * pitch), w, 180, "pr", i)
+    raise ValueError("Invalid pad style")
+
+def port_rects(ports, half_width, depth):
+    # (N, 4) bounds of the rectangles that extend depth behind each port and half_width to either side
+    u = np.stack([np.cos(np.radians(ports.orientations)), np.sin(np.radians(ports.orientations))], axis=-1)
+    n = np.abs(u[:, ::-1]) * half_width
+    corners = np.stack([ports.midpoints + n, ports.midpoints - n, ports.midpoints - u * depth + n, ports.midpoints - u * depth - n], axis=1)
+    return np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1)
+
+def bar_rects(array, bars):
+    # vertical and horizontal bar bodies, grown by the bar_width squares route_pads_single and
+    # route_pads_single_line put on the unrouted bar ends
+    w, (nx, ny) = array.bar_width, array.num_bars
+    rects = [port_rects(bars[0], w/2, array.bar_lengths[1]), port_rects(bars[2], w/2, array.bar_lengths[0])]
+    if array.pad_style == "single":
+        # as drawn, num_bars // 2 of them at either end
+        ends = [(0, bars[1][0::2][:nx // 2]), (0, bars[0][1::2][:nx // 2]), (1, bars[3][0::2][:ny // 2]), (1, bars[2][1::2][:ny // 2])]
+    elif array.pad_style == "single_line":
+        ends = [(0, bars[1]), (1, bars[2])]
+    else:
+        ends = []
+    for k, p in ends:
+        extender = port_rects(p, w/2, -w)
+        rects[k][p.index, :2] = np.minimum(rects[k][p.index, :2], extender[:, :2])
+        rects[k][p.index, 2:] = np.maximum(rects[k][p.index, 2:], extender[:, 2:])
+    return rects
+
+def rect_edges(rects):
+    x0, y0, x1, y1 = rects.T
+    corners = np.stack([np.stack([x0, y0], -1), np.stack([x1, y0], -1), np.stack([x1, y1], -1), np.stack([x0, y1], -1)], axis=1)
+    return corners, np.roll(corners, -1, axis=1)
+
+def routes(pad, bar, length1, length2, manhattan = None):
+    # route polygons as route_batch draws them, padded to one vertex count by repeating the last
+    # vertex, and the length of their centre lines
+    n = len(pad[0])
+    z = np.ones(n, dtype=bool) if manhattan is None else ~manhattan
+    groups = [(np.flatnonzero(z), path_z(pad[0][z], pad[1][z], bar[0][z], bar[1][z], np.broadcast_to(length1, n)[z], np.broadcast_to(length2, n)[z]))]
+    if manhattan is not None:
+        rows = np.flatnonzero(manhattan)
+        groups += [(rows[index], path) for index, path in path_manhattan(pad[0][manhattan], pad[1][manhattan], pad[2][manhattan], bar[0][manhattan], bar[1][manhattan], bar[2][manhattan])]
+    groups = [(index, path) for index, path in groups if len(index)]
+    polygons = np.empty((n, 2 * max([path.shape[1] for _, path in groups], default=2), 2))
+    lengths = np.zeros(n)
+    for index, path in groups:
+        polygon = extrude(path, pad[2][index], bar[2][index])
+        polygons[index, :polygon.shape[1]] = polygon
+        polygons[index, polygon.shape[1]:] = polygon[:, -1:]
+        lengths[index] = np.linalg.norm(np.diff(path, axis=1), axis=-1).sum(axis=1)
+    return polygons, lengths
+
+def preflight(params, spacing = None, width = None, tol = 1e-3, **build_kwargs):
+    # returns {"ok", "errors", "bbox", "batches", "feasible"}; errors are dicts like drc.check's violations
+    array = diode_array(params)
+    array.set_options(**build_kwargs)
+    errors = []
+    if array.pad_style not in ["double", "single", "interleaved", "single_line"]:
+        return {"ok": False, "errors": [{"rule": "pad_style", "message": f"invalid pad style {array.pad_style!r}"}]}
+    spacing, width = rules(array, spacing, width)
+    w, (d0, d1, d2) = array.bar_width, array.pad_dimensions
+    if array.bar_pitch - w < spacing - tol:
+        errors.append({"rule": "bar_spacing", "distance": float(array.bar_pitch - w), "message": f"bars are {array.bar_pitch - w:g} apart, less than spacing {spacing:g}"})
+
+    bars = bar_ports(array)
+    pads = pad_ports(array)
+    pad_tables = pads if isinstance(pads, list) else [pads]
+    bodies = bar_rects(array, bars)
+    boxes = bodies + [port_rects(p, d0/2 + d2, d1 + 2 * d2) for p in pad_tables]
+
+    report = []
+    for layer, pad, bar, length1, offset, manhattan in array.route_batches(bars, pads):
+        vertical = layer == 1
+        theta = array.route_thetas[0 if vertical else 1]
+        nets = [("v" if vertical else "h") + str(i) for i in (bar.index)]
+        z = np.ones(len(pad), dtype=bool) if manhattan is None else ~manhattan
+        batch = {"layer": layer, "side": str(pad.side[0]) if len(pad) else None, "routes": len(pad), "z_routes": int(z.sum())}
+        if z.any():
+            # offset is the straight run at the bar end; below zero the route doubles back over its bar
+            dx = np.abs(bar.midpoints[:, 0] - pad.midpoints[:, 0])[z]
+            dy = np.abs(bar.midpoints[:, 1] - pad.midpoints[:, 1])[z]
+            along, across = (dy, dx) if vertical else (dx, dy)
+            available = along - np.broadcast_to(length1, len(pad))[z]
+            batch.update(min_offset = float(offset[z].min()), theta = float(theta),
+                         theta_min = float(np.arctan2(across, np.maximum(available, 0)).max()),
+                         min_bar_pad_spacing = float(array.bar_pad_spacing[0 if vertical else 1] - offset[z].min()))
+            for k in np.flatnonzero(z)[offset[z] < -tol]:
+                errors.append({"rule": "route_offset", "layer": layer, "nets": [nets[k]], "offset": float(offset[k]), "location": tuple(pad.midpoints[k].tolist()),
+                               "message": f"route of {nets[k]} needs {-offset[k]:g} more bar_pad_spacing or a route_theta above {np.degrees(batch['theta_min']):.2f} deg"})
+
+        polygons, lengths = routes(pad.arrays(), bar.arrays(), length1, offset, manhattan)
+        a, b = polygons, np.roll(polygons, -1, axis=1)
+        # a zero length segment, like the middle of a Z route whose pad and bar line up across,
+        # extrudes to NaN vertices that every gap below silently passes
+        degenerate = ~np.isfinite(polygons).all(axis=(1, 2))
+        for k in np.flatnonzero(degenerate):
+            errors.append({"rule": "route_degenerate", "layer": layer, "nets": [nets[k]], "location": tuple(pad.midpoints[k].tolist()),
+                           "message": f"route of {nets[k]} has a zero length segment, which extrudes to an outline with NaN vertices"})
+        batch.update(route_length = float(lengths.sum()), max_route_length = float(lengths.max()) if len(pad) else 0.0)
+        # short segments between tight bends pinch the extruded route
+        widths = min_widths(list(polygons)) if len(pad) else np.zeros(0)
+        for k in np.flatnonzero(widths < width - tol):
+            errors.append({"rule": "route_width", "layer": layer, "nets": [nets[k]], "width": float(widths[k]), "location": tuple(pad.midpoints[k].tolist()),
+                           "message": f"route of {nets[k]} narrows to {widths[k]:g}, less than width {width:g}"})
+        # neighbouring routes of a batch, and each route against the pads next to its own; gaps are
+        # measured between outlines, so a route that crosses another or a pad is 0 away from it
+        gaps = np.full(len(pad), np.inf)
+        if len(pad) > 1:
+            d = segment_distances(a[:-1, :, None], b[:-1, :, None], a[1:, None], b[1:, None]).min(axis=(1, 2))
+            gaps = np.minimum(gaps, np.concatenate([d, [np.inf]]))
+            for k in np.flatnonzero(d < spacing - tol):
+                errors.append({"rule": "route_spacing", "layer": layer, "nets": [nets[k], nets[k + 1]], "distance": float(d[k]), "location": tuple(pad.midpoints[k].tolist()),
+                               "message": f"routes of {nets[k]} and {nets[k + 1]} are {d[k]:g} apart, less than spacing {spacing:g}"})
+        rects = port_rects(pad, d0/2 + d2, d1 + 2 * d2)
+        for step in [-2, -1, 1, 2]:
+            k = np.arange(max(0, -step), min(len(pad), len(pad) - step))
+            if len(k) == 0:
+                continue
+            c, e = rect_edges(rects[k + step])
+            d = segment_distances(a[k, :, None], b[k, :, None], c[:, None], e[:, None]).min(axis=(1, 2))
+            gaps[k] = np.minimum(gaps[k], d)
+            for m in np.flatnonzero(d < spacing - tol):
+                errors.append({"rule": "route_pad_spacing", "layer": layer, "nets": [nets[k[m]], nets[k[m] + step]], "distance": float(d[m]), "location": tuple(pad.midpoints[k[m]].tolist()),
+                               "message": f"route of {nets[k[m]]} passes {d[m]:g} from the pad of {nets[k[m] + step]}, less than spacing {spacing:g}"})
+        # and against the bars next to its own
+        body = bodies[0 if vertical else 1]
+        for step in [-1, 1]:
+            k = np.flatnonzero((bar.index + step >= 0) & (bar.index + step < len(body)))
+            if len(k) == 0:
+                continue
+            c, e = rect_edges(body[bar.index[k] + step])
+            d = segment_distances(a[k, :, None], b[k, :, None], c[:, None], e[:, None]).min(axis=(1, 2))
+            gaps[k] = np.minimum(gaps[k], d)
+            for m in np.flatnonzero(d < spacing - tol):
+                other = ("v" if vertical else "h") + str(bar.index[k[m]] + step)
+                errors.append({"rule": "route_bar_spacing", "layer": layer, "nets": [nets[k[m]], other], "distance": float(d[m]), "location": tuple(bar.midpoints[k[m]].tolist()),
+                               "message": f"route of {nets[k[m]]} passes {d[m]:g} from bar {other}, less than spacing {spacing:g}"})
+        batch["min_gap"] = float(gaps.min()) if len(pad) else None
+        report.append(batch)
+        boxes.append(np.concatenate([polygons[~degenerate].min(axis=1), polygons[~degenerate].max(axis=1)], axis=1))
+
+    for p in pad_tables:
+        rects = port_rects(p, d0/2 + d2, d1 + 2 * d2)
+        order = np.argsort(p.midpoints[:, 0] if p.orientations[0] % 180 else p.midpoints[:, 1], kind="stable") if len(p) else []
+        rects, index, vertical = rects[order], p.index[order], np.isin(p.side[order], ["pb", "pt"])
+        if array.pad_style == "single_line":
+            # one column of pads, the first num_bars[0] for the vertical bars
+            vertical = index < array.num_bars[0]
+            index = np.where(vertical, index, index - array.num_bars[0])
+        nets = [("v" if v else "h") + str(i) for v, i in zip(vertical, index)]
+        # rows of interleaved pads alternate, so the next but one pad is the neighbour in the same row
+        for step in [1, 2]:
+            gap = np.hypot(np.maximum(0, np.maximum(rects[step:, 0] - rects[:-step, 2], rects[:-step, 0] - rects[step:, 2])),
+                           np.maximum(0, np.maximum(rects[step:, 1] - rects[:-step, 3], rects[:-step, 1] - rects[step:, 3])))
+            # pads of vertical and horizontal bars are on different layers
+            for k in np.flatnonzero((gap < spacing - tol) & (vertical[step:] == vertical[:-step])):
+                errors.append({"rule": "pad_spacing", "layer": 1 if vertical[k] else 3, "nets": [nets[k], nets[k + step]], "distance": float(gap[k]),
+                               "message": f"pads of {nets[k]} and {nets[k + step]} are {gap[k]:g} apart, less than spacing {spacing:g}"})
+
+    boxes = np.concatenate(boxes)
+    bbox = [boxes[:, :2].min(axis=0).tolist(), boxes[:, 2:].max(axis=0).tolist()]
+    # the smallest bar_pad_spacing and route_thetas (vertical, horizontal) that keep every route offset non-negative
+    feasible = {"bar_pad_spacing": [max([b["min_bar_pad_spacing"] for b in report if b["layer"] == layer and "min_bar_pad_spacing" in b], default=None) for layer in [1, 3]],
+                "route_thetas": [max([b["theta_min"] for b in report if b["layer"] == layer and "theta_min" in b], default=None) for layer in [1, 3]]}
+    return {"ok": not errors, "errors": errors, "bbox": bbox, "batches": report, "feasible": feasible}
@@ -0,0 +1,85 @@
+from concurrent.futures import ProcessPoolExecutor
+from phidl import Device
+import phidl.geometry as pg
+import argparse
+import json
+import os
+import time
+from build_cache import build_cache, params_key, library_version
+from params import from_jsonable
+
+# Places many diode_arrays on one reticle. Placements whose params (and build
+# options) are identical share one design: every distinct design is built once,
+# in parallel, and each placement becomes a reference to its cell, so build time
+# scales with the number of distinct designs rather than with the placements.
+
+def build_design(params, directory, key, build_kwargs = None, cache_directory = None):
+    from diode_array import diode_array
+    start = time.perf_counter()
+    if cache_directory is not None:
+        path = build_cache(cache_directory).build(params, **(build_kwargs or {}))
+    else:
+        array = diode_array(params)
+        array.build(**(build_kwargs or {}))
+        array.save(directory=directory, filename=key)
+        path = os.path.join(directory, key + ".gds")
+    return path, time.perf_counter() - start
+
+def placement(entry):
+    # (params, position) or (params, position, rotation)
+    params, position = entry[0], entry[1]
+    rotation = entry[2] if len(entry) > 2 else 0
+    return params, position, rotation
+
+def compose_reticle(placements, directory, filename, workers = None, build_kwargs = None, cache_directory = None):
+    # without a cache, the design GDS files are kept next to the reticle
+    designs_directory = os.path.join(directory, filename + "_designs")
+    os.makedirs(directory if cache_directory is not None else designs_directory, exist_ok=True)
+    placements = [placement(entry) for entry in placements]
+
+    designs = {}
+    keys = []
+    version = library_version()
+    for params, _, _ in placements:
+        key = params_key(params, build_kwargs, version)
+        designs.setdefault(key, params)
+        keys.append(key)
+
+    start = time.perf_counter()
+    jobs = [(designs[key], designs_directory, key, build_kwargs, cache_directory) for key in designs]
+    if workers == 1 or len(jobs) == 1:
+        results = [build_design(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            results = list(executor.map(build_design, *zip(*jobs)))
+    build_time = time.perf_counter() - start
+
+    cells = {key: pg.import_gds(path) for key, (path, _) in zip(designs, results)}
+    D = Device(filename)
+    for key, (_, position, rotation) in zip(keys, placements):
+        ref = D.add_ref(cells[key])
+        ref.rotate(rotation)
+        ref.move(destination = position)
+    path = os.path.join(directory, filename + ".gds")
+    D.write_gds(path, cellname = filename)
+    return {"path": path, "designs": len(designs), "placements": len(placements), "build_time": build_time,
+            "design_build_times": {key: t for key, (_, t) in zip(designs, results)}}
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Compose many diode_arrays into one hierarchical reticle GDS.")
+    parser.add_argument("layout", help="JSON list of {\"params\": {...}, \"position\": [x, y], \"rotation\": deg}")
+    parser.add_argument("-o", "--directory", default="reticle_output")
+    parser.add_argument("-n", "--filename", default="reticle")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("-c", "--cache", default=None, help="build_cache directory to reuse designs from")
+    args = parser.parse_args(argv)
+
+    with open(args.layout) as f:
+        layout = json.load(f)
+    placements = [(from_jsonable(entry["params"]), entry["position"], entry.get("rotation", 0)) for entry in layout]
+    report = compose_reticle(placements, args.directory, args.filename, workers=args.workers, cache_directory=args.cache)
+    print(f"{report['placements']} placements of {report['designs']} designs written to {report['path']}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,77 @@
+import gdspy
+import gzip
+
+# Incremental GDSII output. Cells are written as soon as they are handed to
+# gds_stream.write and can be dropped by the caller afterwards; only the names of
+# written cells are remembered, so that later cells can reference them. Cell names
+# are made unique the way phidl's write_gds does it, without renaming the Devices
+# for good.
+
+class gds_stream:
+    def __init__(self, path, compress = False, unit = 1e-6, precision = 1e-9, max_cellname_length = 28, compresslevel = 6):
+        self.file = gzip.open(path, "wb", compresslevel = compresslevel) if compress else open(path, "wb")
+        self.writer = gdspy.GdsWriter(self.file, unit = unit, precision = precision)
+        self.max_cellname_length = max_cellname_length
+        self.names = {}
+        self.used_names = set()
+        self.written = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def reserve(self, name):
+        # keeps a name (e.g. the top cell's) from being given to another cell
+        self.used_names.add(name)
+
+    def unique(self, name):
+        name = name[:self.max_cellname_length]
+        unique, n = name, 1
+        while unique in self.used_names:
+            n += 1
+            unique = name + ("%0.3i" % n)
+        self.used_names.add(unique)
+        return unique
+
+    def name(self, cell):
+        if cell.uid not in self.names:
+            self.names[cell.uid] = self.unique(cell.name)
+        return self.names[cell.uid]
+
+    def write_cell(self, cell):
+        # a cell's references are written by name, so its children get their stream names too
+        renamed = [cell] + [reference.ref_cell for reference in cell.references]
+        original = [c.name for c in renamed]
+        for c in renamed:
+            c.name = self.name(c)
+        try:
+            self.writer.write_cell(cell)
+        finally:
+            for c, n in zip(renamed, original):
+                c.name = n
+        self.written.add(cell.uid)
+        return self.names[cell.uid]
+
+    def write(self, device):
+        # writes device and every cell below it that has not been written yet, returns its name
+        if device.uid in self.written:
+            return self.names[device.uid]
+        for cell in device.get_dependencies(recursive = True):
+            if cell.uid not in self.written:
+                self.write_cell(cell)
+        return self.write_cell(device)
+
+    def write_references(self, name, children):
+        # a cell holding one reference at the origin to each of the named, already written
+        # cells; name is used as is, see reserve() and unique()
+        cell = gdspy.Cell(name, exclude_from_current = True)
+        for child in children:
+            cell.add(gdspy.CellReference(child, ignore_missing = True))
+        self.writer.write_cell(cell)
+        return name
+
+    def close(self):
+        self.writer.close()
+        self.file.close()
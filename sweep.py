@@ -0,0 +1,103 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from params import to_jsonable, from_jsonable
+import argparse
+import json
+import os
+import time
+import traceback
+
+# Builds many diode_array variants in a process pool. Every finished GDS is written
+# by its worker as soon as it is drawn, and one manifest line (params -> filename,
+# build time, status) is appended per job as results come in, so a crashed or
+# interrupted sweep still leaves a usable manifest behind.
+
+def param_grid(base_params, grid):
+    keys = list(grid)
+    variants = []
+    for values in product(*[grid[k] for k in keys]):
+        params = dict(base_params)
+        params.update(zip(keys, values))
+        variants.append(params)
+    return variants
+
+def build_variant(params, directory, filename, draw_kwargs = None):
+    from diode_array import diode_array
+    start = time.perf_counter()
+    try:
+        array = diode_array(params)
+        array.draw(**(draw_kwargs or {}))
+        array.save(directory=directory, filename=filename)
+        status, error = "ok", None
+    except Exception as e:
+        status, error = "failed", "".join(traceback.format_exception_only(type(e), e)).strip()
+    return {"filename": filename + ".gds" if status == "ok" else None, "params": to_jsonable(params),
+            "build_time": time.perf_counter() - start, "status": status, "error": error}
+
+def rejected_variant(params, draw_kwargs = None):
+    # the manifest record of a variant preflight finds infeasible, or None
+    from preflight import preflight
+    try:
+        report = preflight(params, **{k: v for k, v in (draw_kwargs or {}).items() if k == "single_pad_offsets"})
+    except Exception:
+        # left to the build, whose error ends up in the manifest
+        return None
+    if report["ok"]:
+        return None
+    return {"filename": None, "params": to_jsonable(params), "build_time": 0.0, "status": "rejected",
+            "error": "; ".join(e["message"] for e in report["errors"][:5]) + (f" (+{len(report['errors']) - 5} more)" if len(report["errors"]) > 5 else "")}
+
+def run_sweep(variants, directory, prefix = "variant", workers = None, draw_kwargs = None, manifest = "manifest.jsonl", preflight = False):
+    # with preflight, variants that fail preflight.preflight are recorded as rejected without being drawn
+    os.makedirs(directory, exist_ok=True)
+    records = []
+    with open(os.path.join(directory, manifest), "a") as manifest_file:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for i, params in enumerate(variants):
+                filename = f"{prefix}_{i:04d}"
+                record = rejected_variant(params, draw_kwargs) if preflight else None
+                if record is not None:
+                    record["index"] = i
+                    manifest_file.write(json.dumps(record) + "\n")
+                    records.append(record)
+                    continue
+                futures[executor.submit(build_variant, params, directory, filename, draw_kwargs)] = (i, params, filename)
+            for future in as_completed(futures):
+                i, params, filename = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    # the worker itself died (e.g. killed for memory), not just the build
+                    record = {"filename": None, "params": to_jsonable(params), "build_time": None,
+                              "status": "failed", "error": f"{type(e).__name__}: {e}"}
+                record["index"] = i
+                manifest_file.write(json.dumps(record) + "\n")
+                manifest_file.flush()
+                records.append(record)
+    return sorted(records, key=lambda r: r["index"])
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Generate diode_array variants over a parameter grid.")
+    parser.add_argument("base", help="JSON file with the base params dict")
+    parser.add_argument("grid", help="JSON file mapping param names to lists of values to sweep")
+    parser.add_argument("-o", "--directory", default="sweep_output")
+    parser.add_argument("-p", "--prefix", default="variant")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--preflight", action="store_true", help="skip variants that fail the analytic pre-flight check")
+    args = parser.parse_args(argv)
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.grid) as f:
+        grid = json.load(f)
+    variants = [from_jsonable(params) for params in param_grid(base, grid)]
+    records = run_sweep(variants, args.directory, prefix=args.prefix, workers=args.workers, preflight=args.preflight)
+    failed = [r for r in records if r["status"] != "ok"]
+    print(f"{len(records) - len(failed)}/{len(records)} variants built in {args.directory}")
+    for r in failed:
+        print(f"  variant {r['index']}: {r['error']}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,66 @@
+from phidl import Device
+from phidl.device_layout import Port
+import phidl.routing as pr
+import numpy as np
+import gdspy
+import pytest
+from diode_array import diode_array
+
+# The batch router has to draw the same routes as the per-route pr.route_sharp calls
+# it replaced: for every pad style, the route polygons of each layer are XORed with
+# those of route_sharp on the same port pairs and the difference must be empty.
+
+def params(pad_style, num_bars):
+    return {"pad_dimensions": np.array([60, 60, 5]), "pad_pitch": 100, "bar_width": 20, "bar_pitch": 40,
+            "num_bars": np.array(num_bars), "circle_radius": 5, "bar_pad_spacing": np.array([320, 320]),
+            "interleaved_pad_spacing": 15, "pad_route_dist": 20, "pad_style": pad_style,
+            "route_thetas": [np.pi/4, np.pi/4], "text_size": 40, "invert_be": False}
+
+def port(table, row):
+    return Port(midpoint=table.midpoints[row], width=table.widths[row], orientation=table.orientations[row])
+
+def route_sharp_layers(array):
+    # the routes of the last build, drawn one route_sharp call at a time; also returns the path types used
+    bars, pads = array.stage_output("bars")[3], array.stage_output("pads")[3]
+    layers, path_types = {1: Device(), 3: Device()}, set()
+    for layer, pad, bar, length1, offset, manhattan in array.route_batches(bars, pads):
+        for row in range(len(pad)):
+            if manhattan is not None and manhattan[row]:
+                route = pr.route_sharp(port(pad, row), port(bar, row), path_type="manhattan", layer=layer)
+                path_types.add("manhattan")
+            else:
+                route = pr.route_sharp(port(pad, row), port(bar, row), path_type="Z", length1=np.broadcast_to(length1, len(pad))[row],
+                                       length2=offset[row], layer=layer)
+                path_types.add("Z")
+            layers[layer].add_ref(route)
+    return {layer: D.get_polygons() for layer, D in layers.items()}, path_types
+
+def batch_layers(array):
+    # the route cells of the last build, without the extenders single and single_line add next to them
+    polygons = {}
+    for part in array.stage_output("routes")[:2]:
+        for reference in part.references:
+            if reference.parent.name == "routes":
+                for (layer, _), p in reference.get_polygons(by_spec=True).items():
+                    polygons.setdefault(layer, []).extend(p)
+    return polygons
+
+def xor_area(a, b):
+    result = gdspy.boolean(a, b, "xor", precision=1e-4)
+    return 0.0 if result is None else result.area()
+
+@pytest.mark.parametrize("num_bars", [(7, 9), (8, 6)])
+@pytest.mark.parametrize("pad_style, single_pad_offsets", [("double", [0, 0, 0, 0]), ("interleaved", [0, 0, 0, 0]), ("single_line", [0, 0, 0, 0]),
+                                                           ("single", [0, 0, 0, 0]), ("single", [30, 10, 30, 10])])
+def test_routes_match_route_sharp(pad_style, single_pad_offsets, num_bars):
+    array = diode_array(params(pad_style, num_bars))
+    array.build(single_pad_offsets=single_pad_offsets)
+    expected, path_types = route_sharp_layers(array)
+    actual = batch_layers(array)
+    assert sorted(actual) == [1, 3]
+    for layer in [1, 3]:
+        assert len(actual[layer]) == len(expected[layer])
+        assert xor_area(actual[layer], expected[layer]) < 1e-6
+    if pad_style == "single_line" or single_pad_offsets[0] == 30:
+        # vertical bars directly across from their pads are routed manhattan style
+        assert path_types == {"Z", "manhattan"}
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import drc
+from benchmark import base_params
+from diode_array import diode_array
+
+# The spatial indexes of drc.py must find every pair of polygons that comes within the
+# spacing rule, which is checked against comparing every edge with every other on small
+# arrays, and must keep the candidate pairs growing with the number of bars rather than
+# with the area the fan-out routes span.
+
+def layer_polygons(pad_style, n, layer = 1):
+    array = diode_array(base_params(pad_style, n, False))
+    array.build()
+    polygons = []
+    for name in ["bars", "pads", "routes"]:
+        for part in array.stage_output(name)[:2]:
+            polygons += part.get_polygons(by_spec=True).get((layer, 0), [])
+    return array, drc.padded(polygons)
+
+def brute_force_pairs(P, spacing):
+    a, b, owner = drc.edges(P)
+    i, j = np.triu_indices(len(a), 1)
+    keep = owner[i] != owner[j]
+    i, j = i[keep], j[keep]
+    d = drc.segment_distances(a[i], b[i], a[j], b[j])
+    pairs = {}
+    for p, q, distance in zip(np.minimum(owner[i], owner[j]), np.maximum(owner[i], owner[j]), d):
+        if distance < spacing:
+            pairs[(p, q)] = min(distance, pairs.get((p, q), np.inf))
+    return pairs
+
+@pytest.mark.parametrize("spacing", [20, 300])
+@pytest.mark.parametrize("pad_style", ["double", "interleaved", "single_line", "single"])
+def test_polygon_pairs_match_brute_force(pad_style, spacing):
+    _, P = layer_polygons(pad_style, 6)
+    a, b, owner = drc.edges(P)
+    length = drc.piece_length(a, b, spacing)
+    i, j, d = drc.polygon_pairs(P, a, b, owner, drc.slices(P, length), spacing, length)
+    found = {(p, q): distance for p, q, distance in zip(i, j, d) if distance < spacing}
+    expected = brute_force_pairs(P, spacing)
+    assert found.keys() == expected.keys()
+    assert all(abs(found[key] - expected[key]) < 1e-9 for key in expected)
+
+def work(pad_style, n):
+    # candidate edge and containment pairs, edge pieces and polygon slices of one layer
+    array, P = layer_polygons(pad_style, n)
+    spacing = drc.rules(array)[0]
+    a, b, _ = drc.edges(P)
+    length = drc.piece_length(a, b, spacing)
+    boxes, owner = drc.slices(P, length)
+    return (len(drc.edge_pairs(a, b, spacing, length)[0]) + len(drc.slice_pairs(P[:, 0], boxes, owner, 0)[0])
+            + len(drc.edge_pieces(a, b, length)[0]) + len(boxes))
+
+@pytest.mark.parametrize("pad_style", ["double", "interleaved"])
+def test_work_grows_near_linearly(pad_style):
+    # four times the bars: linear growth is 4x, the quadratic growth of indexing whole
+    # fan-out routes by their bounding boxes is 16x
+    assert work(pad_style, 128) < 8 * work(pad_style, 32)
+
+def test_non_finite_route_is_reported():
+    # pads and bars of one net line up across, so its Z route has a zero length middle
+    # segment and extrudes to NaN vertices
+    params = dict(base_params("interleaved", 4, False), pad_dimensions = np.array([30, 60, 5]), bar_pitch = 50,
+                  bar_pad_spacing = np.array([300, 300]))
+    array = diode_array(params)
+    array.build()
+    violations = drc.check(array)
+    assert [(v["rule"], v["layer"]) for v in violations if v["rule"] == "non_finite"] == [("non_finite", 3)]
@@ -0,0 +1,61 @@
+import numpy as np
+import gdspy
+import pytest
+from diode_array import diode_array
+from inversion import geometry, bounding_box, tile_bounds
+
+# The tiled inversion must cover exactly what pg.boolean's whole-die inversion covers:
+# for every pad style and tiling, the XOR of the two results has to be empty, also
+# where neighbouring tiles meet and when the tiles are clipped in a process pool.
+# The XOR unions each side first, so tiles that overlap their neighbours are caught by
+# comparing the summed polygon areas, and seams that do not meet by the vertices
+# falling off the clipper's precision grid.
+
+PRECISION = 1e-4
+
+def params(pad_style):
+    return {"pad_dimensions": np.array([60, 60, 5]), "pad_pitch": 100, "bar_width": 20, "bar_pitch": 40,
+            "num_bars": np.array([7, 9]), "circle_radius": 5, "bar_pad_spacing": np.array([320, 320]),
+            "interleaved_pad_spacing": 15, "pad_route_dist": 20, "pad_style": pad_style,
+            "route_thetas": [np.pi/4, np.pi/4], "text_size": 40, "invert_be": True}
+
+def inversion(pad_style, **build_kwargs):
+    array = diode_array(params(pad_style))
+    array.build(**build_kwargs)
+    return array.stage_output("inversion").get_polygons()
+
+def area(polygons):
+    return sum(abs(np.sum(p[:, 0] * np.roll(p[:, 1], -1) - np.roll(p[:, 0], -1) * p[:, 1])) / 2 for p in polygons)
+
+@pytest.fixture(scope="module")
+def full():
+    return {}
+
+@pytest.mark.parametrize("invert_workers", [1, 2])
+@pytest.mark.parametrize("invert_tiles", [[7, 9], [3, 3]])
+@pytest.mark.parametrize("pad_style", ["double", "single", "interleaved", "single_line"])
+def test_tiled_matches_full(full, pad_style, invert_tiles, invert_workers):
+    if pad_style not in full:
+        full[pad_style] = inversion(pad_style, invert_mode="full")
+    tiled = inversion(pad_style, invert_mode="tiled", invert_tiles=invert_tiles, invert_workers=invert_workers)
+    result = gdspy.boolean(full[pad_style], tiled, "xor", precision=PRECISION)
+    assert result is None or result.area() < 1e-6
+    assert area(tiled) == pytest.approx(area(full[pad_style]), abs=1e-6)
+    vertices = np.concatenate(tiled)
+    assert np.abs(np.round(vertices / PRECISION) * PRECISION - vertices).max() < 1e-9
+
+@pytest.mark.parametrize("hierarchical", [False, True])
+@pytest.mark.parametrize("pad_style", ["double", "single", "interleaved", "single_line"])
+def test_geometry_matches_flattened(pad_style, hierarchical):
+    # the per-stage parts stream() inverts against hold the same back end as get_polygons(),
+    # and bounding_box agrees with gdspy's
+    array = diode_array(params(pad_style))
+    array.build(hierarchical=hierarchical)
+    parts = geometry(array.be)
+    bounds = bounding_box(array.be)
+    assert np.allclose(bounds, array.be.get_bounding_box())
+    assert np.allclose(bounding_box(array.device), array.device.get_bounding_box())
+    key = lambda p: np.round(p, 6).tobytes()
+    for tile in tile_bounds(bounds, [3, 3]):
+        expected = [p for p in array.be.get_polygons() if p[:, 0].min() <= tile[2] and p[:, 0].max() >= tile[0] and p[:, 1].min() <= tile[3] and p[:, 1].max() >= tile[1]]
+        assert sorted(map(key, [p for part in parts for p in part.touching(tile)])) == sorted(map(key, expected))
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+import drc
+from diode_array import diode_array
+from preflight import preflight
+
+# preflight() has to pass the layouts drc.check finds clean and fail those it does not,
+# without drawing anything, and has to name routes it cannot draw instead of letting
+# their NaN outlines through every gap comparison.
+
+def params(pad_style, **changes):
+    p = {"pad_dimensions": np.array([60, 60, 5]), "pad_pitch": 100, "bar_width": 20, "bar_pitch": 40,
+         "num_bars": np.array([7, 9]), "circle_radius": 5, "bar_pad_spacing": np.array([320, 320]),
+         "interleaved_pad_spacing": 15, "pad_route_dist": 20, "pad_style": pad_style,
+         "route_thetas": [np.pi/4, np.pi/4], "text_size": 40, "invert_be": False}
+    p.update(changes)
+    return p
+
+def violations(p):
+    array = diode_array(p)
+    array.build()
+    return drc.check(array)
+
+@pytest.mark.parametrize("pad_style", ["double", "single"])
+def test_good_layout_passes(pad_style):
+    report = preflight(params(pad_style))
+    assert report["ok"] and report["errors"] == []
+    assert violations(params(pad_style)) == []
+
+def test_bad_layout_fails():
+    # too little bar_pad_spacing for the routes to fan out at 45 degrees
+    p = params("double", bar_pad_spacing = np.array([150, 150]))
+    report = preflight(p)
+    assert not report["ok"]
+    assert {"route_offset", "route_spacing"} <= {e["rule"] for e in report["errors"]}
+    assert "short" in {v["rule"] for v in violations(p)}
+
+def test_degenerate_route_is_named():
+    # the pad of h3 lines up with its bar, so the middle of its Z route has zero length
+    p = params("interleaved", pad_dimensions = np.array([30, 60, 5]), bar_pitch = 50, num_bars = np.array([4, 4]),
+               bar_pad_spacing = np.array([300, 300]))
+    report = preflight(p)
+    assert not report["ok"]
+    assert [(e["rule"], e["layer"], e["nets"]) for e in report["errors"]] == [("route_degenerate", 3, ["h3"])]
+    assert np.isfinite(report["bbox"]).all()
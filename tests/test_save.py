@@ -0,0 +1,70 @@
+import numpy as np
+import gdspy
+import pytest
+from diode_array import diode_array
+from hierarchy import gds_size
+from ports import port_table
+
+# save(report = True) compares a hierarchical export with the flat one the same params and
+# options would give, drawing only the labels and routes again for it. load() has to give
+# back what save() wrote: the same polygons on every layer, the same params and options,
+# and port tables equal to the ones the build drew.
+
+# write_gds stores vertices on a 1 nm grid, so the build is snapped to it before comparing
+GRID, PRECISION = 1e-3, 1e-4
+
+def params(pad_style, invert_be):
+    return {"pad_dimensions": np.array([60, 60, 5]), "pad_pitch": 100, "bar_width": 20, "bar_pitch": 40,
+            "num_bars": np.array([7, 9]), "circle_radius": 5, "bar_pad_spacing": np.array([320, 320]),
+            "interleaved_pad_spacing": 15, "pad_route_dist": 20, "pad_style": pad_style,
+            "route_thetas": [np.pi/4, np.pi/4], "text_size": 40, "invert_be": invert_be}
+
+def area(polygons):
+    return sum(abs(np.sum(p[:, 0] * np.roll(p[:, 1], -1) - np.roll(p[:, 0], -1) * p[:, 1])) / 2 for p in polygons)
+
+def concatenate(ports):
+    bar_ports, pad_ports = ports
+    return port_table.concatenate(bar_ports + (pad_ports if isinstance(pad_ports, list) else [pad_ports]))
+
+def fail(*args):
+    raise AssertionError("stage drawn again")
+
+@pytest.mark.parametrize("invert_be", [False, True])
+@pytest.mark.parametrize("pad_style", ["double", "interleaved", "single_line", "single"])
+def test_report_reuses_stages(tmp_path, monkeypatch, pad_style, invert_be):
+    array = diode_array(params(pad_style, invert_be))
+    array.build(invert_mode = "tiled", hierarchical = True)
+    stages, rebuilt, options = dict(array.stages), list(array.rebuilt), dict(array.options)
+    for name in ["bars", "circles", "pads", "inversion"]:
+        monkeypatch.setattr(diode_array, "build_" + name, fail)
+    report = array.save(tmp_path, "array", report = True)
+    monkeypatch.undo()
+    assert array.stages == stages and array.rebuilt == rebuilt and array.options == options
+
+    flat = diode_array(array.params)
+    flat.build(**dict(options, hierarchical = False))
+    assert report["flat_size"] == gds_size(flat.device, "array")
+
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("pad_style", ["double", "interleaved", "single_line", "single"])
+def test_load_round_trip(tmp_path, pad_style, compress):
+    array = diode_array(params(pad_style, True))
+    array.build(single_pad_offsets = [10, 0, 0, 10], invert_mode = "tiled", hierarchical = True)
+    array.save(tmp_path, "array", compress = compress)
+    loaded = diode_array.load(tmp_path, "array")
+    assert loaded.options == array.options and loaded.stages == {}
+    assert all(np.array_equal(np.asarray(value), np.asarray(loaded.params[key])) for key, value in array.params.items())
+
+    built, reloaded = array.device.get_polygons(by_spec=True), loaded.device.get_polygons(by_spec=True)
+    assert built.keys() == reloaded.keys()
+    for spec in built:
+        snapped = [np.round(p / GRID) * GRID for p in built[spec]]
+        assert gdspy.boolean(snapped, reloaded[spec], "xor", precision=PRECISION) is None
+        assert area(reloaded[spec]) == pytest.approx(area(snapped))
+
+    expected, ports = concatenate(array.port_tables()), concatenate(loaded.port_tables())
+    assert ports.names() == expected.names()
+    for column in ["midpoints", "widths", "orientations"]:
+        assert np.allclose(getattr(ports, column), getattr(expected, column))
+    assert sorted(loaded.device.ports) == sorted(expected.names())
+    assert all(np.allclose(loaded.device.ports[name].midpoint, midpoint) for name, midpoint in zip(expected.names(), expected.midpoints))
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from diode_array import diode_array
+
+# stream() draws with its own options: the last build(), its stages and the options
+# save() records for it must come out of it untouched, and the back end is only ever
+# inverted in tiles so memory stays bounded.
+
+def params(invert_be):
+    return {"pad_dimensions": np.array([60, 60, 5]), "pad_pitch": 100, "bar_width": 20, "bar_pitch": 40,
+            "num_bars": np.array([7, 9]), "circle_radius": 5, "bar_pad_spacing": np.array([320, 320]),
+            "interleaved_pad_spacing": 15, "pad_route_dist": 20, "pad_style": "single",
+            "route_thetas": [np.pi/4, np.pi/4], "text_size": 40, "invert_be": invert_be}
+
+def test_stream_leaves_build_untouched(tmp_path):
+    array = diode_array(params(True))
+    array.build(single_pad_offsets = [0, 0, 0, 0], invert_mode = "tiled")
+    options, device, stages = dict(array.options), array.device, dict(array.stages)
+    array.stream(tmp_path, "streamed", single_pad_offsets = [40, 40, 40, 40], invert_tiles = [3, 3])
+    assert array.options == options and array.single_pad_offsets == [0, 0, 0, 0] and array.invert_tiles == [8, 8]
+    assert array.device is device and array.stages == stages
+    array.save(tmp_path, "built")
+    loaded = diode_array.load(tmp_path, "built")
+    assert loaded.options == options
+
+def test_stream_refuses_full_inversion(tmp_path):
+    with pytest.raises(ValueError, match="invert_mode"):
+        diode_array(params(True)).stream(tmp_path, "streamed", invert_mode = "full")